@@ -3,10 +3,11 @@
 Find the best and worst returns for specified investment periods
 """
 import sys
-import matplotlib.pyplot as plt
+import numpy as np
 from market import Market
-from buckets import bucketwidth, bucketize, distribution, value_offset
+from buckets import Histogram
 from compound import compound_rate
+from plots import pyplot, finish
 
 
 # graphical output parameters
@@ -41,6 +42,51 @@ def total_return(sequence, first, years, monthly=False):
     return balance
 
 
+def window_returns(market, horizons):
+    """
+        compute the net return for every starting point and every period
+        (from the market's cumulative growth index, so each window is O(1))
+        :param market:   Market whose data is to be used
+        :param horizons: list of holding periods (years)
+        :return (array): (len(horizons), N) value(end)/value(start) for the
+                         windows starting at each point (NaN if they would
+                         run past the end of the data)
+    """
+    points = market.growth.size
+    starts = np.arange(points)
+    lengths = np.asarray(horizons)[:, None]
+    if market.params["monthly"]:
+        lengths = lengths * 12
+    inside = starts + lengths <= points
+    returns = market.window_returns(starts, np.where(inside, lengths, 0))
+    return np.where(inside, returns, np.nan)
+
+
+def horizon_summary(returns, percentiles=(5, 25, 50, 75, 95)):
+    """
+        summarize the distribution of returns for each holding period
+        :param returns:  (horizons, N) array from window_returns
+        :param percentiles: percentiles to be reported
+        :return (dict): per-horizon arrays of count, worst, best and
+                        percentiles (a (horizons, len(percentiles)) array)
+    """
+    return {"count": np.sum(~np.isnan(returns), axis=1),
+            "worst": np.nanmin(returns, axis=1),
+            "best": np.nanmax(returns, axis=1),
+            "percentiles": np.nanpercentile(returns, percentiles,
+                                            axis=1).T}
+
+
+def distribution_of(returns, row):
+    """
+        the full distribution of returns for one holding period
+        :param returns:  (horizons, N) array from window_returns
+        :param row:      index of the desired horizon
+        :return (array): return for every window of that length
+    """
+    return returns[row][~np.isnan(returns[row])]
+
+
 def main(args):
     """
     for all possible sequences of specified number of years
@@ -48,16 +94,20 @@ def main(args):
         tracking the best and worst total returns
     :param (string): name of market data CSV file
     :param -v:   produce verbose output
+    :param --no-plot: print (but do not plot) the period's distribution
     :param (int) period: period to be bucketized
     """
     # process the command line arguments
     market_data = "sp500.csv"
     verbose = False
+    plot = True
     period = 0
     monthly = True
     for _i, arg in enumerate(args):
         if arg in ('-v', '--verbose'):
             verbose = True
+        elif arg == '--no-plot':
+            plot = False
         elif arg.isdigit():
             period = int(arg)
         else:
@@ -66,55 +116,41 @@ def main(args):
     # get a standard market simulator
     simulator = Market(market_data,
                        start=FIRST_YEAR, end=LAST_YEAR, monthly=monthly)
-    sequences = simulator.chosen()
 
     # find the best and worst return for each investment period
-    for years in range(MIN_YEARS, MAX_YEARS+1):
-        worst = 666.0
-        best = -666.0
-        count = 0
-
-        # try all sequences for the current duration
-        final = len(sequences) - (12 * years)
-        for i in range(final):
-            ret = total_return(sequences, i, years)
-            if ret < worst:
-                worst = ret
-            if ret > best:
-                best = ret
-            count += 1
-
-        if verbose:
-            print(f"{years:2d} years, {count} sequences:" +
+    horizons = list(range(MIN_YEARS, MAX_YEARS+1))
+    if period > 0 and period not in horizons:
+        horizons.append(period)
+    returns = window_returns(simulator, horizons)
+    summary = horizon_summary(returns)
+
+    if verbose:
+        for row, years in enumerate(horizons[:MAX_YEARS + 1 - MIN_YEARS]):
+            worst = summary["worst"][row]
+            best = summary["best"][row]
+            print(f"{years:2d} years, {summary['count'][row]} sequences:" +
                   f"{worst:5.1f} - {best:5.1f}" +
                   f"\tannual: {100*compound_rate(worst, years):.2f}%" +
                   f" - {100*compound_rate(best, years):.2f}%")
 
     # generate the distribution of returns for specified period
     if period > 0:
-        results = []
-        final = len(sequences) - period
-        for i in range(final):
-            results.append(total_return(sequences, i, period))
+        results = distribution_of(returns, horizons.index(period))
 
         # bucketize the results for display
-        granularity = bucketwidth(results)
-        buckets = bucketize(results, granularity)
-        offset = value_offset(results)
-        (x_values, y_values) = distribution(buckets, granularity, offset)
+        histogram = Histogram()
+        histogram.add(results)
+        (x_values, y_values) = histogram.distribution()
         for i in range(len(x_values)):
             x_values[i] *= 100
             print(f"  {(x_values[i]):5.1f}    {y_values[i]}")
-        plt.plot(x_values, y_values, "go")
-        plt.title(TITLE + f" ({FIRST_YEAR}-{LAST_YEAR})")
-        plt.xlabel(f"Total {period}-year Return (%)")
-        plt.ylabel("probablity (%)")
-        if OUTPUT is None:
-            plt.show()
-        else:
-            print("Saving distribution plot as " + OUTPUT)
-            plt.savefig(OUTPUT)
-            plt.close()
+        if plot:
+            plt = pyplot(OUTPUT)
+            plt.plot(x_values, y_values, "go")
+            plt.title(TITLE + f" ({FIRST_YEAR}-{LAST_YEAR})")
+            plt.xlabel(f"Total {period}-year Return (%)")
+            plt.ylabel("probablity (%)")
+            finish(plt, OUTPUT)
 
 
 # pylint: disable=C0103
@@ -1,74 +1,147 @@
 """
 These methods turn lists of results into distributions for plotting
 """
+import numpy as np
 
+FINE = 20               # fine buckets per power of ten (divisible by 2, 4)
+MIN_POWER = 1.0e-6      # (finest) power of ten for a bucket width
 
-def bucketwidth(results):
+
+def scale_of(data_range):
     """
-    determine a good bucket width for a set of performance results
-    :param [(float)]: simulation results
-    :return (float): suggested bucket width
+    find the power of ten on which to base the bucket width for a range
+    :param data_range(float): difference between largest and smallest result
+    :return (float): power of ten that gives 10-100 buckets (so that
+                     there are at most 100 * FINE fine buckets)
     """
-    max_result = 0.0
-    min_result = 666.666
-    for result in results:
-        if result > max_result:
-            max_result = result
-        if result < min_result:
-            min_result = result
-
-    # try pick a size that results in reasonable number of buckets
-    data_range = max_result - min_result
-    width = 1.0
-    while data_range/width < 10:
-        width /= 10
-
-    if data_range/width < 25:
-        return width/4
-    if data_range/width < 50:
-        return width/2
-    return width
-
-
-def bucketize(results, granularity):
+    power = 1.0
+    while data_range/power >= 100:
+        power *= 10
+    while power > MIN_POWER and data_range/power < 10:
+        power /= 10
+    return power
+
+
+def width_of(data_range, power):
     """
-    turn a list of results into buckets and counts
-    :param [(float)]: simulation results
-    :param (int): desired bucket width
-    :return [(int)] list of bucket counts
+    pick a bucket size that results in reasonable number of buckets
+    :param data_range(float): difference between largest and smallest result
+    :param power(float): power of ten (from scale_of) for that range
+    :return (float): suggested bucket width
     """
-    # figure out how many buckets we need
-    max_result = 0.0
-    min_result = 666.666
-    for result in results:
-        if result > max_result:
-            max_result = result
-        if result < min_result:
-            min_result = result
+    if data_range/power < 25:
+        return power/4
+    if data_range/power < 50:
+        return power/2
+    return power
 
-    data_range = max_result - min_result
-    num_buckets = int((data_range + granularity)/granularity)
-    buckets = [0] * (num_buckets)
 
-    # compute the count for each bucket
-    for result in results:
-        bucket = int((result-min_result)/granularity)
-        buckets[bucket] += 1
-
-    return buckets
+def regroup(base, counts, factor):
+    """
+    combine (aligned) buckets into (aligned) buckets factor times as wide
+    :param base(int): bucket number (value/width) of counts[0]
+    :param counts [int ...]: count in each bucket
+    :param factor(int): number of old buckets per new bucket
+    :return (int, [int ...]): new base and counts
+    """
+    numbers = (base + np.arange(counts.size)) // factor
+    return (int(numbers[0]),
+            np.bincount(numbers - numbers[0], weights=counts,
+                        minlength=1).astype(np.int64))
 
 
-def value_offset(results):
+class Histogram:
     """
-    find the difference between the lowest sample value and zero
-    :param [(float)]: simulation results
-    :return (float) lowest sample value
+    A histogram of results, that can consume them incrementally (or in
+    arrays), and be merged with others (e.g. from other workers).
+
+    Counts are kept in fine buckets (1/FINE of the power of ten on which
+    the bucket width will be based), aligned on multiples of their width,
+    so that they can be exactly combined into wider buckets as the range
+    of results grows, and when the distribution is produced.
     """
-    min_result = 666.666
-    for result in results:
-        if result < min_result:
-            min_result = result
-    return min_result
+
+    def __init__(self):
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.power = MIN_POWER      # power of ten the buckets are based on
+        self.base = 0               # bucket number of counts[0]
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def rescale(self, power):
+        """
+        widen the fine buckets to be based on a (larger) power of ten
+        :param power(float): new power of ten
+        """
+        if power > self.power and self.counts.size > 0:
+            factor = int(round(power / self.power))
+            (self.base, self.counts) = regroup(self.base, self.counts, factor)
+        self.power = max(power, self.power)
+
+    def deposit(self, base, counts):
+        """
+        add counts (for fine buckets at our current scale) to our own
+        :param base(int): bucket number of counts[0]
+        :param counts [int ...]: count in each bucket
+        """
+        if self.counts.size == 0:
+            (self.base, self.counts) = (base, counts)
+            return
+        low = min(base, self.base)
+        high = max(base + counts.size, self.base + self.counts.size)
+        merged = np.zeros(high - low, dtype=np.int64)
+        merged[self.base - low:self.base - low + self.counts.size] += \
+            self.counts
+        merged[base - low:base - low + counts.size] += counts
+        (self.base, self.counts) = (low, merged)
+
+    def add(self, results):
+        """
+        add one or more results to the histogram
+        :param results: a result, or a list/array of them
+        """
+        results = np.asarray(results, dtype=np.float64).ravel()
+        if results.size == 0:
+            return
+        self.count += results.size
+        self.min = min(self.min, results.min())
+        self.max = max(self.max, results.max())
+        self.rescale(scale_of(self.max - self.min))
+
+        numbers = np.floor(results / (self.power / FINE)).astype(np.int64)
+        first = numbers.min()
+        self.deposit(int(first), np.bincount(numbers - first))
+
+    def merge(self, other):
+        """
+        add the contents of another histogram to this one
+        :param other (Histogram): histogram to be merged into this one
+        """
+        if other.count == 0:
+            return
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.rescale(max(other.power, scale_of(self.max - self.min)))
+
+        (base, counts) = (other.base, other.counts)
+        if other.power < self.power:
+            factor = int(round(self.power / other.power))
+            (base, counts) = regroup(base, counts, factor)
+        self.deposit(base, counts)
+
+    def distribution(self):
+        """
+        turn the histogram into scatter-plot points
+        :return ([x-values], [y-percentage-values])
+        """
+        if self.count == 0:
+            return ([], [])
+        width = width_of(self.max - self.min, self.power)
+        factor = int(round(width / (self.power / FINE)))
+        (base, buckets) = regroup(self.base, self.counts, factor)
+        return distribution(buckets, width, base * width)
 
 
 def distribution(buckets, granularity, offset):
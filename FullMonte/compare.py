@@ -0,0 +1,150 @@
+"""
+Compare every purchasing strategy against the same (common) sequences
+
+Each batch of sequences is drawn once and fed to every registered
+strategy kernel, so the outcomes are paired run-by-run, and differences
+between strategies can be estimated with far fewer runs than it would
+take to separate independently sampled results.
+"""
+import sys
+import math
+from functools import partial
+import numpy as np
+from market import Market, sampling, describe
+from runner import summarize
+from moments import Moments
+from compound import compound_rate
+from strat_all import strat_all_choices
+from strat_dips import strat_dips_batch
+from strat_bottom import strat_bottom_batch
+from strat_continuous import strat_continuous_batch
+
+
+def all_label(in_cds):
+    """ name an all-in/all-out choice """
+    return "All-In/Out " + ("CDs" if in_cds else "market")
+
+
+def dips_label(combo):
+    """ name a (max_dip, buy_points) combination """
+    (max_dip, buy_points) = combo
+    return f"Buy the Dips({int(100*max_dip)}%/{buy_points})"
+
+
+def bottom_label(fractions):
+    """ name a number of bottom-buying lots """
+    return f"Bottom-Buying in {fractions} pieces"
+
+
+def continuous_label(months):
+    """ name a continuous purchase period """
+    return f"Continuous Purchases over {months // 12} years"
+
+
+# registered strategies (all on monthly sequences):
+#   name: (kernel(growth, dividend, interest, points), points, label(point))
+STRATEGIES = {
+    "allin": (partial(strat_all_choices, monthly=True), [True, False],
+              all_label),
+    "dips": (partial(strat_dips_batch, monthly=True),
+             [(max_dip, buy_points)
+              for max_dip in (0.10, 0.15, 0.20, 0.25)
+              for buy_points in (1, 2, 3)],
+             dips_label),
+    "bottom": (partial(strat_bottom_batch, monthly=True), [1, 2, 3, 4],
+               bottom_label),
+    "continuous": (partial(strat_continuous_batch, monthly=True),
+                   [12, 24, 36, 48, 60], continuous_label),
+}
+BASELINE = ("allin", False)   # everything in the market, from the start
+KERNELS = {name: kernel for (name, (kernel, _points, _label))
+           in STRATEGIES.items()}
+
+
+def evaluate(growth, dividend, interest, columns, baseline=BASELINE):
+    """
+    evaluate (each point of) every strategy against one batch of sequences
+
+    :param growth: (runs, length) array of appreciation
+    :param dividend: (runs, length) array of dividends
+    :param interest: (runs, length) array of interest rates
+    :param columns: list of (strategy, point, paired) columns, where a
+                    paired column is the difference between that outcome
+                    and the baseline's outcome for the same sequence
+    :param baseline: (strategy, point) that paired columns are relative to
+    :return (array): (runs, columns) outcomes (or paired differences)
+    """
+    # gather the points for each strategy, so each kernel runs only once
+    wanted = {}
+    for (name, point) in [baseline] + [col[:2] for col in columns]:
+        points = wanted.setdefault(name, [])
+        if point not in points:
+            points.append(point)
+
+    outcomes = {}
+    for (name, points) in wanted.items():
+        results = KERNELS[name](growth, dividend, interest, points)
+        for (col, point) in enumerate(points):
+            outcomes[(name, point)] = results[:, col]
+
+    base = outcomes[baseline]
+    return np.stack([outcomes[(name, point)] - base if paired
+                     else outcomes[(name, point)]
+                     for (name, point, paired) in columns], axis=1)
+
+
+# general simulation parameters
+NUM_RUNS = 1000     # number of (common) runs for every strategy
+NUM_YEARS = 20      # number of years to track results
+BLOCK_YEARS = 5     # mean length of a bootstrap block
+
+
+# pylint: disable=too-many-locals
+def main(random, names=None, workers=None, seed=None):
+    """
+    Run every (chosen) strategy against the same sequences, and report
+    each one's results and its (paired) difference from the baseline
+
+    :param random(bool): random months (vs real sequences), or other mode
+    :param names: list of strategies to be compared (default: all)
+    :param workers(int): number of worker processes (default: one per cpu)
+    :param seed(int): seed for the random choices (for reproducible runs)
+    """
+    names = names if names else list(STRATEGIES)
+    chosen = [(name, point) for name in names
+              for point in STRATEGIES[name][1]]
+    if BASELINE not in chosen:
+        chosen.insert(0, BASELINE)
+    columns = [(name, point, False) for (name, point) in chosen] + \
+              [(name, point, True) for (name, point) in chosen]
+
+    simulator = Market(monthly=True)
+    summaries = summarize(simulator, evaluate, columns, NUM_RUNS,
+                          NUM_YEARS*12, random=random, workers=workers,
+                          seed=seed, collect=Moments)
+    outcomes = summaries[:len(chosen)]
+    differences = summaries[len(chosen):]
+    base = outcomes[chosen.index(BASELINE)]
+
+    print(describe(random) + " comparison vs " +
+          STRATEGIES[BASELINE[0]][2](BASELINE[1]) +
+          f" ({outcomes[0].count} common runs)")
+    for ((name, point), moments, paired) in zip(chosen, outcomes,
+                                                differences):
+        # independent samples would have had this much uncertainty
+        unpaired = math.sqrt(moments.sem() ** 2 + base.sem() ** 2)
+        report = "{}, {} years: mean={:.2f}, sigma={:.2f}, {:.2f}%/y" + \
+                 "\n\tdifference={:+.3f} +/- {:.3f} (unpaired +/- {:.3f})"
+        print(report.format(STRATEGIES[name][2](point), NUM_YEARS,
+                            moments.mean, moments.stdev(),
+                            100*compound_rate(moments.mean, NUM_YEARS),
+                            paired.mean, 2 * paired.sem(), 2 * unpaired))
+
+
+if __name__ == "__main__":
+    # usage: [random|blocks|all] [latin|quasi] [seed] [strategy ...]
+    ARGS = sys.argv[1:]
+    SEEDS = [int(arg) for arg in ARGS if arg.isdigit()]
+    main(sampling(ARGS, BLOCK_YEARS * 12),
+         names=[arg for arg in ARGS if arg in STRATEGIES],
+         seed=SEEDS[0] if SEEDS else None)
@@ -4,36 +4,30 @@ A compound interest computation
 
 Author: Mark Kampe
 """
+import numpy as np
 
 
 def compound_interest(rate, years):
     """
     compute compound interest multiplier
 
-    :param rate(float): as a fraction (0.0-1.0)
-    :param years(int):  number of years of compounding
-    :return (float):    what 1.0 would compound to
+    :param rate(float): as a fraction (0.0-1.0), or an array of them
+    :param years(int):  number of years of compounding (or an array)
+    :return (float):    what 1.0 would compound to (array for arrays)
     """
-    balance = 1.0
-    for _ in range(years):
-        balance *= (1.0 + rate)
-
-    return balance
+    balance = np.power(1.0 + np.asarray(rate, dtype=np.float64), years)
+    return balance if balance.ndim else float(balance)
 
 
 def compound_rate(value, years):
     """
     figure out the rate that would yield an appreciation
-    :param value(float):    value of 1.0 after specified years
-    :param years(int):      number of years of compounding
-    return (float):         rate as a fraction (0.0-1.0)
+    :param value(float):    value of 1.0 after specified years (or array)
+    :param years(int):      number of years of compounding (or array)
+    return (float):         rate as a fraction (0.0-1.0) (array for arrays)
     """
-    rate = -0.5
-    for delta in (0.1, 0.01, 0.001, 0.0001):
-        while compound_interest(rate+delta, years) <= value:
-            rate += delta
-
-    return rate
+    rate = np.power(np.asarray(value, dtype=np.float64), 1.0 / years) - 1.0
+    return rate if rate.ndim else float(rate)
 
 
 def main():
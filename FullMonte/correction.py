@@ -6,7 +6,13 @@ they spend how bad) of corrections.  Then compute the expected return
 Author: Mark Kampe
 """
 import sys
-import matplotlib.pyplot as plt
+import numpy as np
+from datacache import cached
+from history import History
+from plots import pyplot, finish
+
+ODDS_VERSION = 2    # bump when a change to drop_odds alters its tables
+OUTPUT = "Correction.png"   # plot file (when not displaying it)
 
 
 class Correction:
@@ -14,31 +20,21 @@ class Correction:
     Process a set of (year, month, price) records to identify drops
     Produce a list of counts for how many times a drop (of a specified size)
     occurred within that history.
-    """
-    input_file = ""     # file used for simulations
-    prices = []         # (year, month, price)
 
-    def column(self, header, desired):
-        """
-        Helper to locate the desired field from a header line
+    Each instance keeps its own window of the (read-only) prices:
+        years, months, prices: date and price of each data point
 
-        :param headers(str): header line
-        :param desired(str): desired column heading
-        :return (int): column number for desired field
-        """
-        fields = header.split(',')
-        if desired in fields:
-            return fields.index(desired)
-        sys.stderr.write("Unable to find " + desired +
-                         " column in " + self.input_file)
-        sys.exit()
-
-    # pylint: disable=too-many-arguments, too-many-locals
+    Many analyses (e.g. different windows of years, or other price
+    columns) can share one digested History of the file.
+    """
+
+    # pylint: disable=too-many-arguments
     def __init__(self, filename="sp500.csv",
                  start=1950, end=2020,
                  date_field="Date",
                  price_field="SP500",   # "Real Price" is inflation adjusted
-                 date_format="y-m-d", ):
+                 date_format="y-m-d",
+                 history=None):
         """
         Instantiate a collection of price data
 
@@ -48,49 +44,28 @@ class Correction:
         :param date_field: column heading for dates
         :param price_field: column heading for price
         :param date_format: date format
+        :param history: already digested History of the file (if any)
         """
-        # pylint: disable=R1732     # don't want to indent next 50 lines
-        source = open(filename, "r", encoding='ascii')
-
-        # figure out which columns we want
-        headers = source.readline()
-        date_col = self.column(headers, date_field)
-        price_col = self.column(headers, price_field)
-
-        # figure out the date format
-        delimiter = date_format[1]
-        fields = date_format.split(delimiter)
-        year_col = fields.index('y')
-        if 'm' in fields:
-            month_col = fields.index('m')
-
-        # process the entire file
-        prev = -1
-        points = 0
-        for line in source:
-            fields = line.split(',')
-
-            # make sure we have all of the expected data
-            if fields[date_col] == "" or fields[price_col] == "":
-                continue
-
-            # extract the interesting fields
-            price = float(fields[price_col])
-            date = fields[date_col]
-            date_fields = date.split(delimiter)
-            year = int(date_fields[year_col])
-            month = int(date_fields[month_col])
-            if prev < 0:
-                prev = price
-
-            # see if this is within the requested range
-            if start <= year <= end:
-                tupple = (year, month, price)
-                self.prices.append(tupple)
-                prev = price
-                points += 1
-
-        source.close()
+        # digest the entire file once, and take our window from that
+        if history is None:
+            history = History(filename, date_field, date_format)
+        self.history = history
+        self.input_file = history.input_file
+        self.params = {"start": start, "end": end, "price_field": price_field}
+        (self.years, self.months, self.prices) = \
+            history.prices(**self.params)
+
+    def view(self, **changes):
+        """
+        derive another analysis from the same (already digested) history,
+        e.g. a different window of years, or another price column
+
+        :param changes: start, end and/or price_field values that differ
+                        from this analysis's
+        :return (Correction): the new analysis
+        """
+        return Correction(history=self.history,
+                          **dict(self.params, **changes))
 
     def drop_buckets(self, bucket_width=.01):
         """
@@ -99,35 +74,112 @@ class Correction:
         :param bucket_widtn (fractional percentage): width of a bucket
         :return [(drop, count)]: # samples in each drop bucket
         """
+        (drops, new_high) = drawdowns(self.prices)
 
-        samples = []
-        prev_high = -1
-        for (_year, _month, price) in self.prices:
-            # keep track of the previous high
-            if price > prev_high:
-                prev_high = price
-                continue
+        # new highs are not drops
+        buckets = np.floor(drops[~new_high] / bucket_width).astype(np.int64)
+        counts = np.bincount(buckets)
+        return [(i * bucket_width, int(count))
+                for i, count in enumerate(counts)]
 
-            # (allocate and) increment the bucket for this drop
-            drop_fraction = (prev_high - price) / prev_high
-            bucket_num = int(drop_fraction/bucket_width)
-            if bucket_num >= len(samples):
-                for i in range(len(samples), bucket_num+1):
-                    tupple = (i * bucket_width, 0)
-                    samples.append(tupple)
+    def further_drops(self, bucket_width=.01):
+        """
+        Compute (or recall) the conditional probabilities of further drops
 
-            (bucket, count) = samples[bucket_num]
-            samples[bucket_num] = (bucket, count+1)
+        :param bucket_width (fractional percentage): grid spacing
+        :return (array): odds[i, j] = P(falls >= j * width more
+                                        | drop is >= i * width)
+        """
+        params = self.params
+        return cached(self.input_file,
+                      ("Correction odds", ODDS_VERSION,
+                       self.history.date_params,
+                       params["start"], params["end"], params["price_field"],
+                       bucket_width),
+                      lambda: drop_odds(self.prices, bucket_width))
 
-        return samples
 
+def drawdowns(prices):
+    """
+    Compute how far the prices are below their previous high, in one pass
 
-def analyze(buckets, width):
+    :param prices (array): prices, in chronological order
+    :return (array, array): fractional drop (from the previous high) at
+                            each point, and whether each is a new high
+    """
+    highs = np.maximum.accumulate(prices)
+    new_high = np.ones(prices.size, dtype=bool)
+    new_high[1:] = prices[1:] > highs[:-1]
+    return ((highs - prices) / highs, new_high)
+
+
+def drop_odds(prices, bucket_width=.01):
+    """
+    Compute, for every pair of grid points, the probability that (given
+    the market is down at least X) it falls at least Y more before it
+    recovers to its previous high.
+
+    :param prices (array): prices, in chronological order
+    :param bucket_width (fractional percentage): grid spacing
+    :return (array): odds[i, j] = P(falls >= j * width more
+                                    | drop is >= i * width)
+    """
+    (drops, new_high) = drawdowns(prices)
+
+    # the worst drop from each point until the next new high: a reversed
+    # running max, offset so that it starts afresh in each correction
+    episode = np.cumsum(new_high)
+    offset = 2.0 * (episode[-1] - episode)
+    worst = np.maximum.accumulate((drops + offset)[::-1])[::-1] - offset
+
+    # count (current, further) drop bucket pairs for points in corrections,
+    # where the further drop is how much worse it gets before it recovers
+    now = np.floor(drops[~new_high] / bucket_width).astype(np.int64)
+    later = np.maximum(worst - drops, 0.0)[~new_high]    # (rounding)
+    later = np.floor(later / bucket_width).astype(np.int64)
+    size = max(now.max(), later.max()) + 2 if now.size else 1
+    counts = np.zeros((size, size))
+    np.add.at(counts, (now, later), 1)
+
+    # further[i, j] = # points with current drop >= i and further drop >= j
+    further = counts[::-1, ::-1].cumsum(axis=0).cumsum(axis=1)[::-1, ::-1]
+    given = further[:, :1]
+    return np.divide(further, given, out=np.zeros_like(further),
+                     where=given > 0)
+
+
+def chance_of(odds, bucket_width, drop, further):
+    """
+    Look up the probability of a further drop (in constant time)
+
+    :param odds (array): conditional probability table (from drop_odds)
+    :param bucket_width: grid spacing of that table
+    :param drop: current drop (fraction)
+    :param further: additional drop (fraction)
+    :return (float): P(falls >= further more | is down >= drop)
+    """
+    i = int(drop / bucket_width + 1e-9)
+    j = int(further / bucket_width + 1e-9)
+    if i >= odds.shape[0] or j >= odds.shape[1]:
+        return 0.0
+    return float(odds[i, j])
+
+
+# pylint: disable=too-many-locals
+def analyze(buckets, width, odds=None, plot=True, output=None):
     """
     1. Review the data to identify corrections/crashes.
     2. Assess the probability of various drop levels.
     3. Compute the expected return (profit * probability) for each level.
     4. Assign fraction-to-purchase-at-that-discount proportional to expected
+    5. (if we have the odds) show the chances of it dropping another notch
+    6. (if we want a plot) plot expectancy vs drop (displaying it, unless
+       it is to be saved in an output file)
+
+    Without the odds, the probability of a drop level is the fraction of
+    (interesting) time spent there.  With them, it is the probability
+    that a market already down by the minimum drop falls that far, so
+    purchases are not reserved for levels most corrections never reach.
     """
     total_count = 0
     min_drop = 0.08
@@ -146,17 +198,13 @@ def analyze(buckets, width):
     for _index, (drop, count) in enumerate(buckets):
         if drop >= min_drop:
             drops.append(int(drop * 100))
-            exp = drop * count / total_count
+            if odds is None:
+                exp = drop * count / total_count
+            else:
+                exp = drop * chance_of(odds, width, min_drop, drop - min_drop)
             expectancies.append(exp)
             total_exp += exp
 
-    # plot expectancy vs drop
-    plt.plot(drops, expectancies)
-    plt.title("Buying-on-the-dips")
-    plt.xlabel("drop percentage (" + str(int(100*width)) + "% buckets)")
-    plt.xticks(range(0, max_drop, int(100 * width)))
-    plt.ylabel("Expected Profit")
-
     # recommend purchanses in proportion to expectancy
     print("Recommended Purchases:")
     tot_pct = 0
@@ -165,18 +213,32 @@ def analyze(buckets, width):
         weight = int(100 * exp / total_exp)
         if weight <= 1:
             continue
-        print(f"-{drop: >2}%:\t{weight: >3}%")
+        if odds is None:
+            print(f"-{drop: >2}%:\t{weight: >3}%")
+        else:
+            chance = chance_of(odds, width, drop / 100, width)
+            print(f"-{drop: >2}%:\t{weight: >3}%" +
+                  f"\t(P(another -{int(100*width)}%)={100*chance:3.0f}%)")
         tot_pct += weight
     print(f"    \t----\n    \t{tot_pct: >3}%")
 
-    plt.show()
+    if plot:
+        # plot expectancy vs drop
+        plt = pyplot(output)
+        plt.plot(drops, expectancies)
+        plt.title("Buying-on-the-dips")
+        plt.xlabel("drop percentage (" + str(int(100*width)) + "% buckets)")
+        plt.xticks(range(0, max_drop, int(100 * width)))
+        plt.ylabel("Expected Profit")
+        finish(plt, output)
 
 
 # basic exerciser
 if __name__ == "__main__":
     # pylint: disable=C0103     # pylint thinks infile is a constant!
-    if len(sys.argv) > 1:
-        infile = sys.argv[1]
+    args = [arg for arg in sys.argv[1:] if arg != "--no-plot"]
+    if len(args) > 0:
+        infile = args[0]
     else:
         infile = "sp500.csv"
 
@@ -184,4 +246,6 @@ if __name__ == "__main__":
 
     results = Correction(infile)
     analyze(results.drop_buckets(bucket_width=BUCKET_WIDTH),
-            width=BUCKET_WIDTH)
+            width=BUCKET_WIDTH,
+            odds=results.further_drops(bucket_width=BUCKET_WIDTH),
+            plot="--no-plot" not in sys.argv)
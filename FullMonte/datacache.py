@@ -0,0 +1,58 @@
+"""
+A (memory-mappable) binary on-disk cache of data parsed from text files
+
+Each cached array is keyed by the content hash of the source file and
+the parameters it was parsed with, so that a change to either one
+automatically causes the file to be re-parsed.
+"""
+import hashlib
+import os
+import numpy as np
+
+CACHE_DIR = ".cache"    # (in the directory of the source file)
+FORMAT = 1              # bump to invalidate all previously cached data
+
+
+def file_hash(filename):
+    """
+    compute a hash of the contents of a file
+
+    :param filename: name of the file
+    :return (str): hex digest of its contents
+    """
+    digest = hashlib.sha256()
+    with open(filename, "rb") as source:
+        for block in iter(lambda: source.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cached(filename, params, parse):
+    """
+    return the array parsed from a file, parsing it only on a cache miss
+
+    :param filename: name of the file to be parsed
+    :param params: (repr-able) parameters that affect the parse
+    :param parse: function() -> the array parsed from the file
+    :return (array): the (read-only, memory-mapped, if cached) array
+    """
+    key = repr((FORMAT, file_hash(filename), params))
+    directory = os.path.join(os.path.dirname(os.path.abspath(filename)),
+                             CACHE_DIR)
+    path = os.path.join(directory,
+                        hashlib.sha256(key.encode()).hexdigest() + ".npy")
+    try:
+        return np.load(path, mmap_mode='r')
+    except (OSError, ValueError):
+        pass
+
+    # parse it and (atomically, in case others are doing the same) save it
+    data = parse()
+    try:
+        os.makedirs(directory, exist_ok=True)
+        temp = f"{path}.{os.getpid()}"
+        np.save(temp, data, allow_pickle=False)
+        os.replace(temp + ".npy", path)
+    except OSError:
+        pass    # an unwritable cache only costs us the parse next time
+    return data
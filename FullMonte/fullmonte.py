@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+"""
+Run any set of strategy simulations (and reports) in a single process
+
+    usage: fullmonte.py [strategy ...] [random|blocks|all] [latin|quasi]
+                        [adaptive] [--no-plot] [seed]
+
+    strategies: allin, bottom, continuous, dips (the default is all of
+                them), compare (all strategies on common sequences) and
+                correction (recommended purchases on the dips)
+
+Every plot is saved (as a .png file), rather than displayed, so that
+no display is needed, and matplotlib is only imported if (and when) a
+plot is actually produced, so text-only (--no-plot) runs start quickly.
+"""
+import sys
+import strat_all
+import strat_bottom
+import strat_continuous
+import strat_dips
+import compare
+from market import sampling
+import correction
+
+# strategy simulations: name: (module, data points per year)
+STRATEGIES = {
+    "allin": (strat_all, 12),
+    "bottom": (strat_bottom, 12),
+    "continuous": (strat_continuous, 1),
+    "dips": (strat_dips, 12),
+}
+BUCKET_WIDTH = 0.04     # correction bucket width
+
+
+def main(args):
+    """
+    run each of the requested simulations (in order)
+
+    :param args: list of command line arguments
+    """
+    seeds = [int(arg) for arg in args if arg.isdigit()]
+    seed = seeds[0] if seeds else None
+    plot = "--no-plot" not in args
+    names = [arg for arg in args
+             if arg in STRATEGIES or arg in ("compare", "correction")]
+
+    for name in names if names else list(STRATEGIES):
+        if name == "compare":
+            compare.main(sampling(args, compare.BLOCK_YEARS * 12), seed=seed)
+        elif name == "correction":
+            results = correction.Correction()
+            correction.analyze(
+                results.drop_buckets(bucket_width=BUCKET_WIDTH),
+                width=BUCKET_WIDTH,
+                odds=results.further_drops(bucket_width=BUCKET_WIDTH),
+                plot=plot, output=correction.OUTPUT)
+        else:
+            (module, per_year) = STRATEGIES[name]
+            module.main(sampling(args, module.BLOCK_YEARS * per_year),
+                        seed=seed,
+                        target=module.TARGET_SEM if "adaptive" in args
+                        else None,
+                        plot=plot)
+        print("")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,169 @@
+"""
+The complete history from a file of market quotes, parsed (once) into
+columns, from which market simulators can cheaply derive their series
+"""
+import sys
+import numpy as np
+from datacache import cached
+
+
+def number(value):
+    """
+    convert a field to a number
+
+    :param value(str): field from a line of the file
+    :return (float): its value (or NaN if it is empty/non-numeric)
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+class History:
+    """
+    Every (numeric) column of a CSV file of dated market quotes
+
+        years, months: date of each record
+        columns: (len(headings), records) array (NaN for missing values)
+
+    These are read-only, so that any number of simulators/analyses can
+    safely share them.
+    """
+
+    def __init__(self, filename="sp500.csv",
+                 date_field="Date",
+                 date_format="y-m-d"):
+        """
+        Digest (or recall the digested) contents of a market quote file
+
+        :param filename: name of file containing market quotes
+        :param date_field: column heading for dates
+        :param date_format: date format
+        """
+        self.input_file = filename
+        self.date_params = (date_field, date_format)
+        with open(filename, "r", encoding='ascii') as source:
+            self.headings = source.readline().rstrip("\n").split(',')
+
+        table = cached(filename, ("History", date_field, date_format),
+                       lambda: self.parse(date_field, date_format))
+        self.years = table[0].astype(np.int32)
+        self.months = table[1].astype(np.int32)
+        self.columns = np.asarray(table[2:])
+        for array in (self.years, self.months, self.columns):
+            array.flags.writeable = False
+
+    def index(self, desired):
+        """
+        Helper to locate the desired field in the headings
+
+        :param desired(str): desired column heading
+        :return (int): column number for desired field
+        """
+        if desired in self.headings:
+            return self.headings.index(desired)
+        sys.stderr.write("Unable to find " + desired +
+                         " column in " + self.input_file)
+        sys.exit()
+
+    def column(self, desired):
+        """
+        return the values of a column (for every record)
+
+        :param desired(str): desired column heading
+        :return (array): the column's values (NaN where missing)
+        """
+        return self.columns[self.index(desired)]
+
+    def parse(self, date_field, date_format):
+        """
+        Digest every record from a file of market quotes
+
+        :param date_field: column heading for dates
+        :param date_format: date format
+        :return: (2 + columns, N) array of (year, month, column values ...)
+        """
+        date_col = self.index(date_field)
+
+        # figure out the date format
+        delimiter = date_format[1]
+        fields = date_format.split(delimiter)
+        year_col = fields.index('y')
+        month_col = fields.index('m') if 'm' in fields else None
+
+        records = []
+        with open(self.input_file, "r", encoding='ascii') as source:
+            source.readline()   # skip the headings
+            for line in source:
+                fields = line.rstrip("\n").split(',')
+                if fields[date_col] == "":
+                    continue
+
+                date_fields = fields[date_col].split(delimiter)
+                year = int(date_fields[year_col])
+                month = (1 if month_col is None
+                         else int(date_fields[month_col]))
+                values = [np.nan if col == date_col else number(value)
+                          for col, value in enumerate(fields)]
+                records.append([year, month] + values)
+
+        # one contiguous row per field
+        return np.ascontiguousarray(
+            np.array(records, dtype=np.float64)
+            .reshape(-1, 2 + len(self.headings)).T)
+
+    # pylint: disable=too-many-arguments, too-many-locals
+    def series(self, monthly, start, end, price_field, div_field, int_field):
+        """
+        derive a market simulator's data points from the history
+
+        :param monthly: monthly (vs annual) prices
+        :param start: first year of data to be used
+        :param end:   last year of data to be used
+        :param price_field: column heading for price
+        :param div_field: column heading for dividends
+        :param int_field: column heading for interest rates
+        :return: (years, months, (3, N) array of (appreciation, div, rate))
+        """
+        price = self.column(price_field)
+        div = self.column(div_field)
+        rate = self.column(int_field)
+
+        # we can only use records that have all of the expected data
+        usable = ~(np.isnan(price) | np.isnan(div) | np.isnan(rate))
+        if not monthly:
+            usable &= self.months == 1      # only annual samples
+        (years, months) = (self.years[usable], self.months[usable])
+        (price, div, rate) = (price[usable], div[usable], rate[usable])
+
+        # we will need to know the last price before our start (and, if
+        # there is none, can only begin with the second point)
+        before = np.flatnonzero(years < start)
+        within = np.flatnonzero((start <= years) & (years <= end))
+        if before.size == 0:
+            (before, within) = (within[:1], within[1:])
+        prices = price[within]
+        prev = np.empty(prices.size)
+        prev[:1] = price[before[-1:]]
+        prev[1:] = prices[:-1]
+
+        # we record all of these as fractional values
+        points = np.array([(prices - prev) / prev,
+                           div[within] / prices,
+                           rate[within] / 100])
+        return (years[within], months[within], points)
+
+    def prices(self, start, end, price_field):
+        """
+        return the (dated) prices within a window of years
+
+        :param start: first year of data to be used
+        :param end:   last year of data to be used
+        :param price_field: column heading for price
+        :return: (years, months, prices) of the records that have a price
+        """
+        price = self.column(price_field)
+        within = np.flatnonzero(~np.isnan(price) &
+                                (start <= self.years) & (self.years <= end))
+        return (self.years[within], self.months[within], price[within])
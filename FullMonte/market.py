@@ -5,30 +5,200 @@ A market return simulator, based on historical data
 Author: Mark Kampe
 """
 import sys
-from random import randint
+import numpy as np
+from history import History
 
 
-class Market:
+# pylint: disable=too-few-public-methods
+class Blocks:
     """
-    Digest a file of market quotes (w/date, dividend, price) data
-    Based on which we can return randomly chosen sequences of returns
+    Block bootstrap sampling: each sequence is assembled from (real,
+    consecutive) blocks of data points, with randomly chosen starts,
+    which preserves short-term autocorrelation (e.g. crash clustering)
+    while yielding (effectively) unlimited distinct sequences.
+
+        length: (mean) number of data points in a block
+        geometric: (stationary bootstrap) block lengths are geometrically
+                   distributed, rather than fixed
+    """
+
+    def __init__(self, length=60, geometric=True):
+        self.length = length
+        self.geometric = geometric
+
+    def __repr__(self):
+        return f"Blocks({self.length}, {self.geometric})"
+
+    # pylint: disable=too-many-arguments
+    def indices(self, rng, size, n_runs, length, sample=None):
+        """
+        choose the data points for a batch of block-bootstrapped sequences
+
+        :param rng: numpy Generator for the random choices
+        :param size: number of available data points
+        :param n_runs: number of desired sequences
+        :param length: number of data points in each sequence
+        :param sample: function(rng, size, shape) to choose block starts
+                       (default: independent uniform choices)
+        :return: (n_runs, length) array of data point indices
+        """
+        steps = np.arange(length)
+        if self.geometric:
+            fresh = rng.random((n_runs, length)) < 1.0 / self.length
+        else:
+            fresh = np.broadcast_to(steps % self.length == 0,
+                                    (n_runs, length)).copy()
+        fresh[:, 0] = True
+
+        # each point continues from the start of the block it is in
+        # (wrapping around, as in a circular block bootstrap)
+        firsts = np.maximum.accumulate(np.where(fresh, steps, 0), axis=1)
+        if sample is None:
+            starts = rng.integers(0, size, size=(n_runs, length))
+        else:
+            starts = sample(rng, size, (n_runs, length))
+        return (np.take_along_axis(starts, firsts, axis=1) +
+                steps - firsts) % size
+
+
+def van_der_corput(count):
     """
-    input_file = ""     # file used for simulations
+    :param count: number of desired points
+    :return (array): first count points of the (base 2) van der Corput
+                     sequence, each of which falls in the largest gap
+                     left by the points before it
+    """
+    index = np.arange(count)
+    points = np.zeros(count)
+    scale = 0.5
+    while index.any():
+        points += (index & 1) * scale
+        index >>= 1
+        scale /= 2
+    return points
+
+
+# pylint: disable=too-few-public-methods
+class Stratified:
+    """
+    Stratified sampling: rather than choosing each run's starting point
+    independently (so that some eras are, by chance, over-represented)
+    the starts for a batch of runs are spread evenly over the history.
+
+        method: latin (a Latin hypercube: one start, at a random place,
+                in each of n_runs equal strata, in random order) or
+                quasi (a randomly shifted van der Corput sequence, in
+                random order)
+        within: what is being stratified: the starts of real sequences
+                (False), every data point (True), or the block starts
+                of a block bootstrap (Blocks)
+
+    Each column (step, for random data points or blocks) is stratified
+    separately, with its own random shift and order.
+    """
+    METHODS = {"latin": "Latin hypercube", "quasi": "Quasi-random"}
+
+    def __init__(self, method="latin", within=False):
+        self.method = method
+        self.within = within
+
+    def __repr__(self):
+        return f"Stratified({self.method!r}, {self.within!r})"
 
-    def column(self, header, desired):
+    def sample(self, rng, size, shape):
         """
-        Helper to locate the desired field from a header line
+        choose evenly spread data points for a batch of runs
 
-        :param headers(str): header line
-        :param desired(str): desired column heading
-        :return (int): column number for desired field
+        :param rng: numpy Generator for the random choices
+        :param size: number of available data points
+        :param shape: (n_runs, columns) number of points to be chosen
+        :return: (n_runs, columns) array of data point indices
         """
-        fields = header.split(',')
-        if desired in fields:
-            return fields.index(desired)
-        sys.stderr.write("Unable to find " + desired +
-                         " column in " + self.input_file)
-        sys.exit()
+        (n_runs, columns) = shape
+        if self.method == "latin":
+            strata = rng.permuted(np.repeat(np.arange(n_runs)[:, None],
+                                            columns, axis=1), axis=0)
+            fractions = (strata + rng.random(shape)) / n_runs
+        else:
+            shifted = van_der_corput(n_runs)[:, None] + rng.random(columns)
+            fractions = rng.permuted(shifted % 1.0, axis=0)
+        return np.minimum((fractions * size).astype(np.int64), size - 1)
+
+    def indices(self, rng, size, n_runs, length):
+        """
+        choose the data points for a batch of (stratified) sequences
+
+        :param rng: numpy Generator for the random choices
+        :param size: number of available data points
+        :param n_runs: number of desired sequences
+        :param length: number of data points in each sequence
+        :return: (n_runs, length) array of data point indices
+        """
+        if isinstance(self.within, Blocks):
+            return self.within.indices(rng, size, n_runs, length,
+                                       self.sample)
+        if self.within:
+            return self.sample(rng, size, (n_runs, length))
+
+        # consecutive values (wrapping around) w/evenly spread starts
+        first = self.sample(rng, size, (n_runs, 1))
+        return (first + np.arange(length)) % size
+
+
+# sampling mode: every (non-wrapping) real sequence, exactly once
+EVERY = "every"
+
+
+def sampling(args, block_length):
+    """
+    choose a sampling mode from (command line) arguments
+
+    :param args: list of arguments (e.g. random, blocks or all, and
+                 latin or quasi for stratified sampling)
+    :param block_length: mean number of data points in a bootstrap block
+    :return: sampling mode (as passed to Market.rates_batch)
+    """
+    if "all" in args:
+        return EVERY
+    mode = Blocks(block_length) if "blocks" in args else "random" in args
+    for method in Stratified.METHODS:
+        if method in args:
+            return Stratified(method, mode)
+    return mode
+
+
+def describe(random):
+    """
+    :param random: sampling mode (as passed to Market.rates_batch)
+    :return (str): name of that mode (e.g. for plot titles)
+    """
+    if isinstance(random, Blocks):
+        return "Block bootstrap"
+    if isinstance(random, Stratified):
+        return Stratified.METHODS[random.method] + " " + \
+            describe(random.within).lower()
+    if random == EVERY:
+        return "All historical"
+    return "Random" if random else "Real sequence"
+
+
+# pylint: disable=too-many-instance-attributes
+class Market:
+    """
+    Digest a file of market quotes (w/date, dividend, price) data
+    Based on which we can return randomly chosen sequences of returns
+
+    The digested data is kept in columnar (float64) form:
+        series:   (3, N) array of (appreciation, dividend, rate) rows
+        growth, dividend, interest: (contiguous) rows of series
+        years, months: date of each data point
+        price_index, total_index: cumulative value (before each point, and
+            after the last) of 1.0 invested before the first point, without
+            and with (monthly-scaled) dividends
+
+    Several simulators (e.g. different windows of years) can share one
+    digested History of the file.
+    """
 
     # pylint: disable=too-many-arguments, too-many-locals
     def __init__(self, filename="sp500.csv",
@@ -38,7 +208,9 @@ class Market:
                  price_field="SP500",       # inflation adjusted
                  div_field="Dividend",      # inflation adjusted
                  int_field="Long Interest Rate",
-                 date_format="y-m-d", ):
+                 date_format="y-m-d",
+                 seed=None,
+                 history=None):
         """
         Instantiate a new simulator
 
@@ -49,118 +221,177 @@ class Market:
         :param date_field: column heading for dates
         :param price_field: column heading for price
         :param date_format: date format
+        :param seed: seed (or numpy Generator) for the random choices
+        :param history: already digested History of the file (if any)
         """
-        # re-initialize the output array
-        self.data_points = []
-
-        # pylint: disable=R1732     # I don't want to indent the next 50 lines
-        source = open(filename, "r", encoding='ascii')
-
-        # figure out which columns we want
-        headers = source.readline()
-        date_col = self.column(headers, date_field)
-        price_col = self.column(headers, price_field)
-        div_col = self.column(headers, div_field)
-        rate_col = self.column(headers, int_field)
-
-        # figure out the date format
-        delimiter = date_format[1]
-        fields = date_format.split(delimiter)
-        year_col = fields.index('y')
-        if 'm' in fields:
-            month_col = fields.index('m')
-
-        # process the entire file
-        prev = 0
-        rate_sum = 0
-        div_sum = 0
-        ret_sum = 0
-        points = 0
-        for line in source:
-            fields = line.split(',')
-
-            # make sure we have all of the expected data
-            if (fields[date_col] == "" or fields[price_col] == "" or
-               fields[div_col] == "" or fields[rate_col] == ""):
-                continue
-
-            # pull out the date to see if it qualifies
-            date = fields[date_col]
-            date_fields = date.split(delimiter)
-            year = int(date_fields[year_col])
-            month = int(date_fields[month_col])
-
-            # we will need to know the last price before our start
-            price = float(fields[price_col])    # dollars
-            if year < start and (monthly or month == 1):
-                prev = price
-
-            # see if this is within the requested range
-            if start <= year <= end:
-                # see if we are doing only annual samples
-                if month != 1 and not monthly:
-                    continue
-
-                # pull out the price, dividend and interest rates
-                appreciation = price - prev         # $
-                div = float(fields[div_col])        # $ interp from 4Q totals
-                rate = float(fields[rate_col])      # % long rate
-
-                # we record all of these as fractional values
-                tupple = (appreciation/prev, div/price, rate/100)
-                self.data_points.append(tupple)
-                prev = price
-
-                # accumulate statistics for the whole sequence
-                ret_sum += appreciation/prev
-                div_sum += div/price
-                rate_sum += rate/100
-                points += 1
+        self.rng = np.random.default_rng(seed)
+
+        # digest the entire file once, and derive our series from that
+        if history is None:
+            history = History(filename, date_field, date_format)
+        self.history = history
+        self.params = {"monthly": monthly, "start": start, "end": end,
+                       "price_field": price_field, "div_field": div_field,
+                       "int_field": int_field}
+        (self.years, self.months, self.series) = \
+            history.series(**self.params)
+        (self.growth, self.dividend, self.interest) = self.series
+
+        # cumulative growth, so that any window's return is O(1)
+        scale = 12 if monthly else 1
+        self.price_index = np.ones(self.growth.size + 1)
+        np.cumprod(1.0 + self.growth, out=self.price_index[1:])
+        self.total_index = np.ones(self.growth.size + 1)
+        np.cumprod(1.0 + self.growth + self.dividend / scale,
+                   out=self.total_index[1:])
 
         # summarize what we just read
+        points = self.growth.size
         period = "monthly" if monthly else "annual"
-        ret_pct = 100 * ret_sum / points * (12 if monthly else 1)
-        div_pct = 100 * div_sum / points
-        rate_pct = 100 * rate_sum / points
-        print(filename +
+        ret_pct = 100 * self.growth.mean() * (12 if monthly else 1)
+        div_pct = 100 * self.dividend.mean()
+        rate_pct = 100 * self.interest.mean()
+        print(history.input_file +
               f"({start}-{end}): {points} {period} data points" +
               f", growth={ret_pct:3.1f}%" +
               f", div={div_pct:2.1f}%" +
               f", int(10y)={rate_pct:2.1f}%")
-        source.close()
+
+    def view(self, seed=None, **changes):
+        """
+        derive another simulator from the same (already digested) history,
+        e.g. annual samples, a different window of years, or other columns
+
+        :param seed: seed (or numpy Generator) for the new simulator
+        :param changes: monthly, start, end, price_field, div_field and/or
+                        int_field values that differ from this simulator's
+        :return (Market): the new simulator
+        """
+        return Market(seed=seed, history=self.history,
+                      **dict(self.params, **changes))
+
+    def window_return(self, first, length, dividends=True):
+        """
+        return the growth over a (contiguous) window of the data
+
+        :param first: index of first data point in the window
+        :param length: number of data points in the window
+        :param dividends: include (reinvested) dividends
+        :return (float): value(end)/value(start)
+        """
+        index = self.total_index if dividends else self.price_index
+        return index[first + length] / index[first]
+
+    def window_returns(self, starts, length, dividends=True):
+        """
+        return the growth over each of many (contiguous) windows of the data
+
+        :param starts: array of indices of first data points in the windows
+        :param length: number of data points (or array of numbers, which
+                       is broadcast against starts) in the windows
+        :param dividends: include (reinvested) dividends
+        :return (array): value(end)/value(start) for each window
+        """
+        index = self.total_index if dividends else self.price_index
+        starts = np.asarray(starts)
+        return index[starts + length] / index[starts]
 
     def rates(self, length=20, random=False):
         """
-        return a (randomly chosen) list of market performance tupples
+        return a (randomly chosen) sequence of market performance tupples
 
         :param length: number of desired prices
-        :param random: random order (vs real sequences)
-        :return: list of price changes (appreciation, dividend, long rate)
+        :param random: random order (vs real sequences), Blocks or Stratified
+        :return: (length, 3) array of (appreciation, dividend, long rate)
+                 (a view of the data, unless it had to be gathered)
         """
-        size = len(self.data_points)
+        size = self.growth.size
+        if isinstance(random, (Blocks, Stratified)):
+            return self.series[:, self.indices(1, length, random)[0]].T
         if random:
             # return random values
-            return [self.data_points[randint(0, size - 1)]
-                    for i in range(0, length)]
+            return self.series[:, self.rng.integers(0, size, length)].T
+
         # return consecutive values w/random starting point
-        first = randint(0, size - 1)
-        return [self.data_points[(first + i) % size]
-                for i in range(0, length)]
+        first = self.rng.integers(0, size)
+        if first + length <= size:
+            return self.series[:, first:first + length].T
+        return self.series[:, (first + np.arange(length)) % size].T
+
+    def indices(self, n_runs, length=20, random=False, rng=None):
+        """
+        choose the data points for a batch of simulated sequences
+
+        :param n_runs: number of desired sequences
+        :param length: number of data points in each sequence
+        :param random: random order (vs real sequences), Blocks or Stratified
+        :param rng: seed or numpy Generator (default: the market's own)
+        :return: (n_runs, length) array of data point indices
+        """
+        rng = self.rng if rng is None else np.random.default_rng(rng)
+        size = self.growth.size
+        if isinstance(random, (Blocks, Stratified)):
+            return random.indices(rng, size, n_runs, length)
+        if random:
+            return rng.integers(0, size, size=(n_runs, length))
+
+        # consecutive values (wrapping around) w/random starting points
+        first = rng.integers(0, size, size=(n_runs, 1))
+        return (first + np.arange(length)) % size
+
+    def rates_batch(self, n_runs, length=20, random=False, rng=None):
+        """
+        return a batch of (randomly chosen) market performance sequences
+
+        :param n_runs: number of desired sequences
+        :param length: number of desired prices in each sequence
+        :param random: random order (vs real sequences), Blocks or Stratified
+        :param rng: seed or numpy Generator (default: the market's own)
+        :return: (3, n_runs, length) array, which unpacks into
+                 (appreciation, dividend, long rate) matrices
+        """
+        return np.take(self.series,
+                       self.indices(n_runs, length, random, rng), axis=1)
+
+    def windows(self, length=20):
+        """
+        return every (non-wrapping) real sequence, without copying the data
+
+        :param length: number of desired prices in each sequence
+        :return: (3, windows, length) read-only view, in which window i
+                 starts at data point i
+        """
+        return np.lib.stride_tricks.sliding_window_view(self.series, length,
+                                                        axis=1)
 
     def chosen(self, first=0, length=0):
         """
-        return a (contiguous) subset of the list
+        return a (contiguous) subset of the data
 
         :param first: index of first desired element
         :param length: number of desired elements
-        :return: list of data points
+        :return: (length, 3) view of the data points
         """
         # figure out how many items to return
         if length == 0:
-            length = len(self.data_points) - first
+            length = self.growth.size - first
+
+        return self.series[:, first:first + length].T
 
-        return [self.data_points[first + i]
-                for i in range(0, length)]
+
+def streams(seed, count):
+    """
+    derive independent random streams (e.g. one per shard) from a seed
+
+    :param seed: None, int, numpy SeedSequence or numpy Generator
+    :param count: number of desired streams
+    :return [SeedSequence]: seeds for statistically independent generators
+    """
+    if isinstance(seed, np.random.Generator):
+        seed = seed.bit_generator.seed_seq
+    elif not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    return seed.spawn(count)
 
 
 def t_dump(app_rate, div_rate, int_rate):
@@ -187,9 +418,9 @@ if __name__ == "__main__":
     for by_month in [False, True]:
         simulator = Market(infile, start=START, end=END, monthly=by_month)
 
-        for do_random in [False, True]:
+        for do_random in [False, True, Blocks(12 if by_month else 5)]:
             print(("Monthly " if by_month else "Annual ") +
-                  ("random return" if do_random else "sequenced return") +
+                  describe(do_random).lower() + " return" +
                   " simulation based on " + infile)
 
             sequence = simulator.rates(random=do_random)
@@ -0,0 +1,71 @@
+"""
+Running (mergeable) summary statistics for simulation results
+"""
+import math
+import numpy as np
+
+
+class Moments:
+    """
+    Count, mean, variance, min and max of a stream of results, computed
+    with Welford's (and Chan's pairwise) updates, so that results can be
+    added a batch at a time, and partial summaries (e.g. from different
+    workers) can be merged, without keeping the results themselves.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.sumsq = 0.0        # sum of squared differences from the mean
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, results):
+        """
+        add one or more results to the summary
+        :param results: a result, or a list/array of them
+        """
+        results = np.asarray(results, dtype=np.float64).ravel()
+        if results.size == 0:
+            return
+        batch = Moments()
+        batch.count = results.size
+        batch.mean = float(results.mean())
+        batch.sumsq = float(np.sum((results - batch.mean) ** 2))
+        batch.min = float(results.min())
+        batch.max = float(results.max())
+        self.merge(batch)
+
+    def merge(self, other):
+        """
+        add the contents of another summary to this one
+        :param other (Moments): summary to be merged into this one
+        """
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.sumsq += other.sumsq + delta * delta * self.count * other.count \
+            / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def variance(self):
+        """
+        :return (float): sample variance of the results
+        """
+        return self.sumsq / (self.count - 1) if self.count > 1 else 0.0
+
+    def stdev(self):
+        """
+        :return (float): sample standard deviation of the results
+        """
+        return math.sqrt(self.variance())
+
+    def sem(self):
+        """
+        :return (float): standard error of the mean of the results
+        """
+        return self.stdev() / math.sqrt(self.count) if self.count else 0.0
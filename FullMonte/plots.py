@@ -0,0 +1,37 @@
+"""
+Lazily imported (and, when saving to a file, headless) plotting
+
+Importing matplotlib (and setting up a display) takes longer than many
+of our reports do, so it is only imported when a plot is actually wanted.
+"""
+
+
+def pyplot(output=None):
+    """
+    import matplotlib's pyplot (the first time a plot is wanted)
+
+    :param output: name of the file the plot will be saved to
+                   (None means that it will be shown on the display)
+    :return: the matplotlib.pyplot module
+    """
+    # pylint: disable=import-outside-toplevel
+    import matplotlib
+    if output is not None:
+        matplotlib.use("Agg")   # we don't need a display to save a file
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def finish(plt, output=None):
+    """
+    show (or save) the plot that has been put up
+
+    :param plt: the matplotlib.pyplot module
+    :param output: name of the file to save it to (None: display it)
+    """
+    if output is None:
+        plt.show()
+    else:
+        print("saving distribution plot as " + output)
+        plt.savefig(output)
+        plt.close()
@@ -0,0 +1,55 @@
+"""
+Vectorized accounting for positions that are bought into over time
+"""
+import numpy as np
+
+
+def fractional_buys(fractions, in_growth, side_growth):
+    """
+    value of positions that start out entirely on the side, and at the
+    start of each period move a fraction of what is left into the market
+
+    :param fractions: (..., length) fraction of the side bought each period
+    :param in_growth: (..., length) growth factor for money in the market
+    :param side_growth: (..., length) growth factor for money on the side
+    :return (array): value of each position at end of simulation
+    """
+    # what is left on the side after each period's purchase and interest
+    on_side = np.cumprod((1.0 - fractions) * side_growth, axis=-1)
+
+    # what was on the side when each period's purchase was made
+    available = np.ones(on_side.shape)
+    available[..., 1:] = on_side[..., :-1]
+
+    # what a dollar invested at the start of each period grows to
+    to_end = np.cumprod(in_growth[..., ::-1], axis=-1)[..., ::-1]
+
+    in_market = np.sum(available * fractions * to_end, axis=-1)
+    return in_market + on_side[..., -1]
+
+
+def scheduled_buys(schedules, in_growth, side_growth):
+    """
+    value of positions that start out entirely on the side, and at the
+    end of each period move a scheduled amount (or whatever is left on
+    the side, if that is less) into the market
+
+    :param schedules: (schedules, length) amount to buy each period
+    :param in_growth: (runs, length) growth factor for money in the market
+    :param side_growth: (runs, length) growth factor for money on the side
+    :return (array): (runs, schedules) value of positions at end
+    """
+    shape = (in_growth.shape[0], schedules.shape[0])
+    in_market = np.zeros(shape)     # start out with nothing in market
+    on_side = np.ones(shape)        # start out with everything on the side
+
+    # every run and schedule advances together, one period at a time
+    for step in range(in_growth.shape[1]):
+        in_market *= in_growth[:, step, None]
+        on_side *= side_growth[:, step, None]
+
+        purchase = np.minimum(schedules[:, step], on_side)
+        in_market += purchase
+        on_side -= purchase
+
+    return in_market + on_side
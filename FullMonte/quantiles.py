@@ -0,0 +1,147 @@
+"""
+A constant-memory (mergeable) sketch of a distribution of results,
+from which percentiles and tail expectations can be estimated
+"""
+import math
+import numpy as np
+
+COMPRESSION = 200                   # (approximate) max number of centroids
+TAIL_PERCENTS = (1, 5, 10, 50)      # percentiles in a tail report
+CVAR_LEVEL = 0.05                   # fraction of worst outcomes averaged
+
+
+class TDigest:
+    """
+    A (merging) t-digest: the results are summarized as a bounded number
+    of weighted centroids, which are very small near the extremes (so
+    that tail percentiles are accurate) and larger in the middle.
+
+    Centroids are (re)built by sorting the old centroids together with
+    the new results, and merging neighbours for as long as the merged
+    centroid spans at most one unit of the (arcsine) scale function.
+    """
+
+    def __init__(self, compression=COMPRESSION):
+        self.compression = compression
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.means = np.zeros(0)
+        self.weights = np.zeros(0)
+
+    def compress(self, means, weights):
+        """
+        rebuild the centroids from a collection of weighted points
+
+        :param means: values of the points (centroids and/or results)
+        :param weights: weights of the points
+        """
+        order = np.argsort(means, kind='stable')
+        (means, weights) = (means[order], weights[order])
+
+        # walk the points, closing each centroid before it would span more
+        # than one unit of the (k1) scale, from its left to right quantile
+        total = weights.sum()
+        rights = np.cumsum(weights) / total
+        firsts = []
+        (first, left) = (0, 0.0)
+        while first < means.size:
+            firsts.append(first)
+            limit = self.unscale(self.scale(left) + 1)
+            first = max(first + 1,
+                        int(np.searchsorted(rights, limit, side='right')))
+            left = rights[first - 1]
+
+        self.weights = np.add.reduceat(weights, firsts)
+        self.means = np.add.reduceat(means * weights, firsts) / self.weights
+
+    def scale(self, quantile):
+        """
+        :param quantile: fraction (0.0-1.0) of the total weight
+        :return (float): the (k1) scale value at that quantile
+        """
+        return self.compression * (math.asin(2 * quantile - 1) / math.pi +
+                                   0.5)
+
+    def unscale(self, value):
+        """
+        :param value: a (k1) scale value
+        :return (float): the quantile at which the scale has that value
+        """
+        if value >= self.compression:
+            return 1.0
+        return (math.sin((value / self.compression - 0.5) * math.pi) + 1) / 2
+
+    def add(self, results):
+        """
+        add one or more results to the sketch
+        :param results: a result, or a list/array of them
+        """
+        results = np.asarray(results, dtype=np.float64).ravel()
+        if results.size == 0:
+            return
+        self.count += results.size
+        self.min = min(self.min, float(results.min()))
+        self.max = max(self.max, float(results.max()))
+        self.compress(np.concatenate((self.means, results)),
+                      np.concatenate((self.weights, np.ones(results.size))))
+
+    def merge(self, other):
+        """
+        add the contents of another sketch (e.g. from another worker)
+        :param other (TDigest): sketch to be merged into this one
+        """
+        if other.count == 0:
+            return
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.compress(np.concatenate((self.means, other.means)),
+                      np.concatenate((self.weights, other.weights)))
+
+    def quantile(self, fractions):
+        """
+        estimate the value below which a fraction of the results lie
+        :param fractions: fraction (0.0-1.0) or array of fractions
+        :return: estimated quantile (array for arrays)
+        """
+        if self.count == 0:
+            return np.full(np.shape(fractions), np.nan)[()]
+
+        # interpolate between the centroids (and the exact extremes)
+        positions = np.cumsum(self.weights) - self.weights / 2
+        x_values = np.concatenate(([0.0], positions, [self.count]))
+        y_values = np.concatenate(([self.min], self.means, [self.max]))
+        return np.interp(np.asarray(fractions) * self.count,
+                         x_values, y_values)[()]
+
+    def percentiles(self, percents=TAIL_PERCENTS):
+        """
+        :param percents: list of percentiles (0-100)
+        :return (array): estimated value at each percentile
+        """
+        return self.quantile(np.asarray(percents, dtype=np.float64) / 100)
+
+    def cvar(self, level=CVAR_LEVEL, steps=1000):
+        """
+        estimate the expected result in the worst (lowest) fraction of cases
+        :param level: fraction (0.0-1.0) of the worst results to average
+        :param steps: number of quantiles averaged over that fraction
+        :return (float): conditional value at risk (expected shortfall)
+        """
+        return float(np.mean(self.quantile(level * (np.arange(steps) + 0.5)
+                                           / steps)))
+
+
+def tails(digest, percents=TAIL_PERCENTS, level=CVAR_LEVEL):
+    """
+    format a percentile table and CVaR for a report
+    :param digest (TDigest): sketch of the results
+    :param percents: list of percentiles (0-100) to be reported
+    :param level: fraction of worst results for CVaR
+    :return (str): one line report
+    """
+    values = digest.percentiles(percents)
+    table = ", ".join(f"p{pct}={value:.2f}"
+                      for (pct, value) in zip(percents, values))
+    return f"\t{table}, CVaR({int(100*level)}%)={digest.cvar(level):.2f}"
@@ -0,0 +1,82 @@
+"""
+A (size-bounded) on-disk cache of simulation results
+
+Each result (e.g. the merged summaries of a sweep) is pickled under a
+hash of everything that determines it, so that re-running an unchanged
+simulation (e.g. to regenerate a plot) costs only a file read.  When the
+cache grows beyond its size limit, the least recently used results are
+evicted.
+"""
+import hashlib
+import os
+import pickle
+from datacache import CACHE_DIR
+
+RESULTS_DIR = "results"     # (within the data cache directory)
+VERSION = 1                 # bump when a change alters simulation results
+MAX_BYTES = 256 << 20       # most space to be used for cached results
+
+
+def evict(directory, max_bytes=MAX_BYTES):
+    """
+    remove the least recently used results until they fit in a budget
+
+    :param directory: directory containing the cached results
+    :param max_bytes: most space the results may use
+    """
+    entries = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.endswith(".pickle"):
+            try:
+                status = os.stat(path)
+            except OSError:
+                continue    # someone else just evicted it
+            entries.append((status.st_mtime, status.st_size, path))
+
+    total = sum(size for (_time, size, _path) in entries)
+    for (_time, size, path) in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass    # someone else beat us to it
+        total -= size
+
+
+def remembered(filename, key, compute, max_bytes=MAX_BYTES):
+    """
+    return a result, computing it only on a cache miss
+
+    :param filename: name of the data file the result is based on
+    :param key: (repr-able) everything else that determines the result
+    :param compute: function() -> the (picklable) result
+    :param max_bytes: most space to be used for cached results
+    :return: the (recalled or newly computed) result
+    """
+    directory = os.path.join(os.path.dirname(os.path.abspath(filename)),
+                             CACHE_DIR, RESULTS_DIR)
+    digest = hashlib.sha256(repr((VERSION, key)).encode()).hexdigest()
+    path = os.path.join(directory, digest + ".pickle")
+    try:
+        with open(path, "rb") as source:
+            result = pickle.load(source)
+        os.utime(path)      # (most recently used)
+        return result
+    except (OSError, EOFError, pickle.UnpicklingError,
+            AttributeError, ImportError):
+        pass    # (e.g. a class in the pickle has been renamed or removed)
+
+    # compute it and (atomically, in case others are doing the same) save it
+    result = compute()
+    try:
+        os.makedirs(directory, exist_ok=True)
+        temp = f"{path}.{os.getpid()}"
+        with open(temp, "wb") as sink:
+            pickle.dump(result, sink, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, path)
+        evict(directory, max_bytes)
+    except OSError:
+        pass    # an unwritable cache only costs us the simulation next time
+    return result
@@ -0,0 +1,532 @@
+"""
+Run Monte-Carlo strategy sweeps across a pool of worker processes
+
+The runs are split into shards (each with its own random stream), whose
+size is chosen (from the number of points and steps) to bound the
+memory each task needs, and, when there are fewer shards than workers,
+the parameter points are split into chunks, so that even a small sweep
+keeps every worker busy.  Every (shard, chunk) pair is evaluated by a
+strategy kernel:
+
+    kernel(growth, dividend, interest, points) -> (runs, len(points))
+
+and the per-shard outcomes are reassembled (or, to run in constant
+memory, summarized per shard and merged) in shard order, so that the
+results do not depend on how many workers there were.
+
+Summaries of reproducible (seeded, or exhaustive) runs are remembered
+on disk, keyed by everything that could affect them, so that repeating
+an unchanged simulation costs only a file read.
+
+When the sampling mode is EVERY, there is no sampling: the kernel is
+evaluated (once) against every real sequence, and those (exact) results
+are cached on disk.
+
+Alternatively, runs can be added (a shard at a time) to each point until
+the standard error of its mean (and, optionally, of a percentile) is
+below a target, so that easy points do not get more runs than they need.
+"""
+import os
+import hashlib
+import inspect
+from functools import partial
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from market import streams, EVERY
+from datacache import cached, file_hash
+from resultcache import remembered
+from moments import Moments
+from buckets import Histogram
+from quantiles import TDigest
+
+SHARD_RUNS = 5000   # most runs per shard (whatever the number of workers)
+TASK_VALUES = 1 << 24   # most (runs x points x steps) values per shard
+BATCH_RUNS = 500    # runs per shard when converging on a target
+MAX_RUNS = 100000   # most runs (per point) when converging on a target
+MIN_BATCHES = 4     # fewest shards for a believable standard error
+
+# market data, shipped to each worker process once (by _adopt)
+_MARKET = {}
+
+# modules whose code affects every simulation's results
+ENGINE = ("market", "history", "purchases", "compound",
+          "runner", "moments", "buckets", "quantiles")
+
+# hash of those modules (computed once per process, by engine_hash)
+_SOURCES = {}
+
+
+class Summary:
+    """
+    What we keep about the outcomes for one parameter point: summary
+    statistics, a histogram and a quantile sketch, all of which can be
+    merged across shards
+    """
+
+    def __init__(self):
+        self.moments = Moments()
+        self.histogram = Histogram()
+        self.digest = TDigest()
+
+    def add(self, results):
+        """
+        add a batch of outcomes to the summary
+        :param results: array of outcomes
+        """
+        self.moments.add(results)
+        self.histogram.add(results)
+        self.digest.add(results)
+
+    def merge(self, other):
+        """
+        add the contents of another summary (e.g. for another shard)
+        :param other (Summary): summary to be merged into this one
+        """
+        self.moments.merge(other.moments)
+        self.histogram.merge(other.histogram)
+        self.digest.merge(other.digest)
+
+
+class Batches(Summary):
+    """
+    A Summary that also keeps track of the distribution of a percentile
+    over the shards, from which (by the method of batch means) we can
+    estimate the standard error of that percentile
+    """
+
+    def __init__(self, percentile=None):
+        super().__init__()
+        self.percentile = percentile
+        self.shards = 0
+        self.batches = Moments()    # of the percentile, for each shard
+
+    def add(self, results):
+        """
+        add a (shard's) batch of outcomes to the summary
+        :param results: array of outcomes
+        """
+        super().add(results)
+        self.shards += 1
+        if self.percentile is not None:
+            self.batches.add(np.percentile(results, self.percentile))
+
+    def merge(self, other):
+        """
+        add the contents of another summary (e.g. for another shard)
+        :param other (Batches): summary to be merged into this one
+        """
+        super().merge(other)
+        self.shards += other.shards
+        self.batches.merge(other.batches)
+
+    def converged(self, target_sem, target_pse=None):
+        """
+        :param target_sem: desired standard error of the mean
+        :param target_pse: desired standard error of the percentile
+        :return (bool): have we had enough runs to meet those targets
+        """
+        if self.shards < MIN_BATCHES or self.moments.sem() > target_sem:
+            return False
+        return target_pse is None or self.batches.sem() <= target_pse
+
+
+def _adopt(market):
+    """
+    worker process initializer: remember the market data to be sampled
+
+    :param market: Market from which sequences are drawn
+    """
+    _MARKET["market"] = market
+
+
+def _run(task):
+    """
+    evaluate one chunk of parameter points against one shard of runs
+
+    :param task: (kernel, points, n_runs, length, random, stream, collect)
+    :return: (n_runs, len(points)) outcomes, or (if there is a collect
+             class) a list of collected outcomes for each point
+    """
+    (kernel, points, n_runs, length, random, stream, collect) = task
+    rng = np.random.default_rng(stream)
+    (growth, dividend, interest) = _MARKET["market"].rates_batch(
+        n_runs, length=length, random=random, rng=rng)
+    outcomes = kernel(growth, dividend, interest, points)
+    if collect is None:
+        return outcomes
+
+    collected = []
+    for col in range(len(points)):
+        collected.append(collect())
+        collected[col].add(outcomes[:, col])
+    return collected
+
+
+@contextmanager
+def _pool(market, workers):
+    """
+    start (once) the worker processes for any number of lists of tasks
+
+    :param market: Market from which sequences are drawn
+    :param workers: number of worker processes
+    :return: (in the with) function(tasks) -> list of task results
+    """
+    if workers <= 1:
+        _adopt(market)
+        yield lambda tasks: [_run(task) for task in tasks]
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_adopt,
+                             initargs=(market,)) as pool:
+        yield lambda tasks: list(pool.map(_run, tasks))
+
+
+def _execute(market, tasks, workers):
+    """
+    run a list of tasks (in a pool of worker processes)
+
+    :param market: Market from which sequences are drawn
+    :param tasks: list of tasks for _run
+    :param workers: number of worker processes (default: one per cpu)
+    :return: list of task results (in task order)
+    """
+    if workers is None:
+        workers = os.cpu_count()
+    with _pool(market, min(workers, len(tasks))) as execute:
+        return execute(tasks)
+
+
+def shard_size(points, length):
+    """
+    choose the number of runs per shard, so that the working set of a
+    task (which grows with runs x points x steps) fits within a budget
+
+    :param points: number of parameter points
+    :param length: number of data points in each sequence
+    :return (int): number of runs per shard
+    """
+    return max(1, min(SHARD_RUNS, TASK_VALUES // max(1, points * length)))
+
+
+# pylint: disable=too-many-arguments
+def _tasks(kernel, points, n_runs, length, random, seed, chunks,
+           shard_runs, workers, collect=None):
+    """
+    split a sweep into (shard, chunk) tasks
+
+    :return: (list of shard sizes, list of point chunks, list of tasks)
+    """
+    # every shard gets an independent stream, regardless of who runs it
+    shards = [min(shard_runs, n_runs - first)
+              for first in range(0, n_runs, shard_runs)]
+
+    # (by default) split the points to give every worker something to do
+    if chunks is None:
+        chunks = max(1, workers // max(1, len(shards)))
+    slices = np.array_split(np.arange(len(points)), min(chunks, len(points)))
+    tasks = [(kernel, [points[i] for i in cols], runs, length, random,
+              stream, collect)
+             for (runs, stream) in zip(shards, streams(seed, len(shards)))
+             for cols in slices]
+    return (shards, slices, tasks)
+
+
+def engine_hash():
+    """
+    hash the (engine) modules that sample the sequences, account for
+    purchases and summarize the outcomes, any of which may affect the
+    results (unlike, e.g., the drivers' reports and plots)
+
+    :return (str): hex digest of the names and contents of those files
+    """
+    if "engine" not in _SOURCES:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha256()
+        for name in ENGINE:
+            digest.update(name.encode())
+            digest.update(file_hash(os.path.join(directory,
+                                                 name + ".py")).encode())
+        _SOURCES["engine"] = digest.hexdigest()
+    return _SOURCES["engine"]
+
+
+def _names(code):
+    """
+    :param code: code object (of a function)
+    :return (list): global names it (or any code nested in it) uses
+    """
+    names = list(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names += _names(const)
+    return names
+
+
+def code_hash(thing, digest=None, seen=None):
+    """
+    hash the source of a kernel (and of the functions, in our modules,
+    that it uses, whether directly, or through partials, dictionaries,
+    lists or tuples that it names)
+
+    :param thing: function, class, functools.partial or container
+    :param digest: hashlib object to be updated (default: a new one)
+    :param seen: ids of things already hashed
+    :return (str): hex digest of that source
+    """
+    (digest, seen) = (digest or hashlib.sha256(), seen or set())
+    if id(thing) in seen:
+        return digest.hexdigest()
+    seen.add(id(thing))
+
+    if isinstance(thing, partial):
+        for part in (thing.func, thing.args, thing.keywords):
+            code_hash(part, digest, seen)
+    elif isinstance(thing, dict):
+        code_hash(list(thing.values()), digest, seen)
+    elif isinstance(thing, (list, tuple)):
+        for part in thing:
+            code_hash(part, digest, seen)
+    elif inspect.isfunction(thing) or inspect.isclass(thing):
+        directory = os.path.dirname(os.path.abspath(__file__))
+        source = inspect.getsourcefile(thing)
+        if source and os.path.dirname(os.path.abspath(source)) == directory:
+            digest.update(inspect.getsource(thing).encode())
+            if inspect.isfunction(thing):
+                for name in _names(thing.__code__):
+                    if name in thing.__globals__:
+                        code_hash(thing.__globals__[name], digest, seen)
+    return digest.hexdigest()
+
+
+def fingerprint(value):
+    """
+    describe a (key) value by its contents, even if it is (or contains)
+    an array, whose repr would elide all but a few of its elements
+
+    :param value: array, list, tuple, dict or other (repr-able) value
+    :return: (repr-able) equivalent, with each array replaced by its
+             type, shape and a hash of its contents
+    """
+    if isinstance(value, np.ndarray):
+        data = np.ascontiguousarray(value)
+        return ("array", data.dtype.str, data.shape,
+                hashlib.sha256(data.tobytes()).hexdigest())
+    if isinstance(value, (list, tuple)):
+        return type(value)(fingerprint(item) for item in value)
+    if isinstance(value, dict):
+        return sorted((key, fingerprint(item)) for (key, item)
+                      in value.items())
+    return value
+
+
+def identity(kernel):
+    """
+    describe a kernel well enough to key cached results
+
+    :param kernel: function (or functools.partial)
+    :return: (repr-able) name, bound arguments, and hashes of its code
+             and of the engine modules (which it runs on)
+    """
+    (func, args, keywords) = (kernel, (), {})
+    if isinstance(kernel, partial):
+        (func, args, keywords) = (kernel.func, kernel.args, kernel.keywords)
+    return (func.__module__, func.__qualname__, fingerprint(args),
+            fingerprint(keywords), code_hash(kernel), engine_hash())
+
+
+def exhaust(market, kernel, points, length):
+    """
+    evaluate a strategy kernel for every parameter point over every
+    (non-wrapping) real sequence, exactly once, as a single batch
+
+    :param market: Market from which sequences are drawn
+    :param kernel: function(growth, dividend, interest, points)
+    :param points: list of parameter points to be evaluated
+    :param length: number of data points in each sequence
+    :return (array): (windows, len(points)) outcomes, in which row i
+                     is for the sequence starting at data point i
+    """
+    def evaluate():
+        (growth, dividend, interest) = market.windows(length)
+        return kernel(growth, dividend, interest, points)
+
+    return cached(market.history.input_file,
+                  ("Exhaust", market.history.date_params, market.params,
+                   length, identity(kernel), fingerprint(list(points))),
+                  evaluate)
+
+
+# pylint: disable=too-many-arguments
+def _remembered(market, kernel, random, seed, params, compute):
+    """
+    return (reproducible) summaries, simulating only on a cache miss
+
+    :param market: Market from which sequences are drawn
+    :param kernel: strategy kernel
+    :param random: sampling mode
+    :param seed: seed for the random choices
+    :param params: (repr-able) everything else that affects the results
+    :param compute: function() -> the summaries
+    :return: the (recalled or newly computed) summaries
+    """
+    if random != EVERY and not isinstance(seed, int):
+        return compute()    # they would not be the same next time anyway
+
+    history = market.history
+    key = (identity(kernel), file_hash(history.input_file),
+           history.date_params, market.params, repr(random), seed, params)
+    return remembered(history.input_file, key, compute)
+
+
+# pylint: disable=too-many-arguments, too-many-locals
+def sweep(market, kernel, points, n_runs, length,
+          random=False, seed=None, workers=None, chunks=None,
+          shard_runs=None):
+    """
+    evaluate a strategy kernel for every parameter point over many runs
+
+    :param market: Market from which sequences are drawn
+    :param kernel: (picklable) function(growth, dividend, interest, points)
+    :param points: list of parameter points to be evaluated
+    :param n_runs: number of runs (sequences) per parameter point
+    :param length: number of data points in each sequence
+    :param random: random order (vs real sequences), Blocks, Stratified
+                   or EVERY
+                   (in which case n_runs is the number of real sequences)
+    :param seed: seed (or numpy Generator) for the random choices
+    :param workers: number of worker processes (default: one per cpu)
+    :param chunks: number of pieces to split the points into (default:
+                   enough to give each worker a task)
+    :param shard_runs: number of runs per shard (default: shard_size)
+    :return (array): (n_runs, len(points)) outcomes
+    """
+    if random == EVERY:
+        return exhaust(market, kernel, points, length)
+
+    workers = os.cpu_count() if workers is None else workers
+    if shard_runs is None:
+        shard_runs = shard_size(len(points), length)
+    (shards, slices, tasks) = _tasks(kernel, points, n_runs, length, random,
+                                     seed, chunks, shard_runs, workers)
+    results = _execute(market, tasks, workers)
+
+    # reassemble the pieces in (shard, chunk) order
+    outcomes = np.empty((n_runs, len(points)))
+    pieces = iter(results)
+    first = 0
+    for runs in shards:
+        for cols in slices:
+            outcomes[first:first + runs, cols] = next(pieces)
+        first += runs
+    return outcomes
+
+
+# pylint: disable=too-many-arguments
+def summarize(market, kernel, points, n_runs, length,
+              random=False, seed=None, workers=None, chunks=None,
+              shard_runs=None, collect=Summary, cache=True):
+    """
+    like sweep, but summarize each shard's outcomes (rather than keeping
+    them) and merge those summaries, so that memory use does not grow
+    with the number of runs
+
+    :param collect: class (w/add and merge methods) to collect outcomes
+    :param cache: remember (and recall) the summaries of seeded runs
+    (other parameters as for sweep)
+    :return [collect]: merged summary of the outcomes for each point
+    """
+    workers = os.cpu_count() if workers is None else workers
+    if shard_runs is None:
+        shard_runs = shard_size(len(points), length)
+    if cache:
+        return _remembered(
+            market, kernel, random, seed,
+            ("summarize", fingerprint(list(points)), n_runs, length,
+             shard_runs, identity(collect)),
+            lambda: summarize(market, kernel, points, n_runs, length,
+                              random=random, seed=seed, workers=workers,
+                              chunks=chunks, shard_runs=shard_runs,
+                              collect=collect, cache=False))
+
+    if random == EVERY:
+        outcomes = exhaust(market, kernel, points, length)
+        summaries = [collect() for _ in points]
+        for (col, summary) in enumerate(summaries):
+            summary.add(outcomes[:, col])
+        return summaries
+
+    (shards, slices, tasks) = _tasks(kernel, points, n_runs, length, random,
+                                     seed, chunks, shard_runs, workers,
+                                     collect)
+    results = iter(_execute(market, tasks, workers))
+
+    # merge the pieces in (shard, chunk) order
+    summaries = [collect() for _ in points]
+    for _shard in shards:
+        for cols in slices:
+            for (col, collected) in zip(cols, next(results)):
+                summaries[col].merge(collected)
+    return summaries
+
+
+# pylint: disable=too-many-arguments, too-many-locals
+def converge(market, kernel, points, length, target_sem,
+             random=False, seed=None, workers=None,
+             percentile=None, target_pse=None,
+             batch_runs=BATCH_RUNS, max_runs=MAX_RUNS, cache=True):
+    """
+    like summarize, but rather than a fixed number of runs, keep adding
+    shards of runs (for the points that still need them) until the
+    standard error of each point's mean (and percentile) is small enough
+
+    Shards are added to each point in a fixed order, and (whichever
+    worker ran it) a shard that arrives after a point has converged is
+    ignored, so the results do not depend on the number of workers.
+
+    :param target_sem: desired standard error of the mean
+    :param percentile: percentile (0-100) whose error is also to be bounded
+    :param target_pse: desired standard error of that percentile
+    :param batch_runs: number of runs per shard
+    :param max_runs: most runs to be used for any point
+    :param cache: remember (and recall) the summaries of seeded runs
+    (other parameters as for sweep)
+    :return [Batches]: merged summary of the outcomes for each point
+                       (whose moments.count is the number of runs used)
+    """
+    collect = partial(Batches, percentile=percentile)
+    if cache:
+        return _remembered(
+            market, kernel, random, seed,
+            ("converge", fingerprint(list(points)), length, target_sem,
+             percentile, target_pse, batch_runs, max_runs),
+            lambda: converge(market, kernel, points, length, target_sem,
+                             random=random, seed=seed, workers=workers,
+                             percentile=percentile, target_pse=target_pse,
+                             batch_runs=batch_runs, max_runs=max_runs,
+                             cache=False))
+    if random == EVERY:
+        return summarize(market, kernel, points, 0, length,
+                         random=random, collect=collect, cache=False)
+
+    if workers is None:
+        workers = os.cpu_count()
+    seeds = streams(seed, max(1, max_runs // batch_runs))
+    summaries = [collect() for _ in points]
+    active = list(range(len(points)))
+    used = 0
+    with _pool(market, min(workers, len(seeds))) as execute:
+        while active and used < len(seeds):
+            # each worker gets a shard of runs for all of the active points
+            tasks = [(kernel, [points[col] for col in active], batch_runs,
+                      length, random, stream, collect)
+                     for stream in seeds[used:used + max(1, workers)]]
+            used += len(tasks)
+            for collected in execute(tasks):
+                for (col, batch) in zip(active, collected):
+                    if not summaries[col].converged(target_sem, target_pse):
+                        summaries[col].merge(batch)
+            active = [col for col in active
+                      if not summaries[col].converged(target_sem,
+                                                      target_pse)]
+    return summaries
@@ -2,11 +2,13 @@
 Purchasing Strategy: all-in/all-out
 """
 import sys
-import statistics
-import matplotlib.pyplot as plt
-from market import Market
-from buckets import bucketwidth, bucketize, distribution, value_offset
+from functools import partial
+import numpy as np
+from market import Market, sampling, describe
+from runner import summarize, converge
 from compound import compound_rate
+from quantiles import tails
+from plots import pyplot, finish
 
 
 def strat_all(sequence, play_it_safe, monthly=False):
@@ -34,68 +36,116 @@ def strat_all(sequence, play_it_safe, monthly=False):
     return balance
 
 
+def strat_all_batch(growth, dividend, interest, play_it_safe, monthly=False):
+    """
+    All in the market or all out of the market, for a batch of sequences
+    :param growth: (runs, length) array of appreciation
+    :param dividend: (runs, length) array of dividends
+    :param interest: (runs, length) array of interest rates
+    :param play_it_safe(bool): are we in market or CDs
+    :param monthly(bool): monthly (vs annual) sequences
+    :return (array): value of each position at end of simulation
+    """
+    # if we are monthly, scale the interest and dividends
+    scale = 12 if monthly else 1
+
+    if play_it_safe:
+        return np.prod(1.0 + interest / scale, axis=1)
+    return np.prod(1.0 + growth + dividend / scale, axis=1)
+
+
+def strat_all_choices(growth, dividend, interest, choices, monthly=False):
+    """
+    All in the market or all out, for a batch of sequences and both choices
+    :param growth: (runs, length) array of appreciation
+    :param dividend: (runs, length) array of dividends
+    :param interest: (runs, length) array of interest rates
+    :param choices: list of play_it_safe (bool) choices
+    :param monthly(bool): monthly (vs annual) sequences
+    :return (array): (runs, choices) values at end of simulation
+    """
+    return np.stack([strat_all_batch(growth, dividend, interest,
+                                     play_it_safe, monthly)
+                     for play_it_safe in choices], axis=1)
+
+
 # general simulation parameters
 NUM_RUNS = 200      # number of runs per model
 NUM_YEARS = 20      # number of years to track results
+BLOCK_YEARS = 5     # mean length of a bootstrap block
+TARGET_SEM = 0.05   # standard error of the mean, for adaptive runs
 MY_NAME = "All-In/Out"
 OUTPUT = "All.png"
 
 
 # pylint: disable=too-many-locals
-def main(random):
+def main(random, workers=None, seed=None, target=None, plot=True):
     """
     For all-in and all-out
         run <num_runs> simulations
         tracking output over 20 years
         plot a return distribution
+    :param random(bool): random months (vs real sequences), or other mode
+    :param workers(int): number of worker processes (default: one per cpu)
+    :param seed(int): seed for the random choices (for reproducible runs)
+    :param target(float): run until the mean's standard error is this small
+    :param plot(bool): plot the distributions (vs just the text report)
     """
 
     # parameters specific to this continuous purchase model
-    title = ("Random" if random else "Real sequence") + " simulations of "
+    title = describe(random) + " simulations of "
     monthly = True     # annual simulations
 
     legends = []
+    curves = []
     simulator = Market(monthly=monthly)
 
-    # purchases spread out over 1-5 years
-    for in_cds in [True, False]:
-        results = []
-        # a statistically interesting number of runs
-        for _runs in range(NUM_RUNS * 2 if random else NUM_RUNS):
-            sequence = simulator.rates(length=NUM_YEARS*12, random=random)
-            results.append(strat_all(sequence, in_cds, monthly))
+    # a statistically interesting number of runs (same for both choices)
+    choices = [True, False]
+    kernel = partial(strat_all_choices, monthly=monthly)
+    if target is None:
+        summaries = summarize(simulator, kernel, choices,
+                              NUM_RUNS * 2 if random else NUM_RUNS,
+                              NUM_YEARS*12, random=random, workers=workers,
+                              seed=seed)
+    else:
+        summaries = converge(simulator, kernel, choices, NUM_YEARS*12, target,
+                             random=random, workers=workers, seed=seed)
 
+    for (in_cds, summary) in zip(choices, summaries):
         # summarize the results
-        mean = sum(results) / len(results)
-        sigma = statistics.stdev(results)
+        mean = summary.moments.mean
+        sigma = summary.moments.stdev()
         report = "{} {}, {} years: mean={:.2f}, sigma={:.2f}, {:.2f}%/y"
         print(report.format(MY_NAME, "CDs" if in_cds else "market",
               NUM_YEARS, mean, sigma, 100*compound_rate(mean, NUM_YEARS)))
+        print(tails(summary.digest))
+        if target is not None:
+            print(f"\t({summary.moments.count} runs)")
 
-        # bucketize and display the results
-        granularity = bucketwidth(results)
-        buckets = bucketize(results, granularity)
-        offset = value_offset(results)
-        (x_values, y_values) = distribution(buckets, granularity, offset)
-
-        plt.plot(x_values, y_values, "go" if in_cds else "b*")
+        # display the distribution of results
+        (x_values, y_values) = summary.histogram.distribution()
+        curves.append((x_values, y_values, "go" if in_cds else "b*"))
         legends.append("CDs" if in_cds else "market")
 
+    if not plot:
+        return
+
     # put up the title, axes, and data
+    plt = pyplot(OUTPUT)
+    for (x_values, y_values, fmt) in curves:
+        plt.plot(x_values, y_values, fmt)
     plt.title(title + MY_NAME)
     plt.xlabel(str(NUM_YEARS) + "-year return")
     plt.ylabel("probability")
     plt.legend(legends)
-    if OUTPUT is None:
-        plt.show()
-    else:
-        print("saving distribution plot as " + OUTPUT)
-        plt.savefig(OUTPUT)
-        plt.close()
+    finish(plt, OUTPUT)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1 and sys.argv[1] == "random":
-        main(True)
-    else:
-        main(False)
+    # usage: [random|blocks|all] [latin|quasi] [adaptive] [--no-plot] [seed]
+    ARGS = sys.argv[1:]
+    SEEDS = [int(arg) for arg in ARGS if arg.isdigit()]
+    main(sampling(ARGS, BLOCK_YEARS * 12), seed=SEEDS[0] if SEEDS else None,
+         target=TARGET_SEM if "adaptive" in ARGS else None,
+         plot="--no-plot" not in ARGS)
@@ -1,12 +1,15 @@
 """
 Purchasing Strategy: by at the bottom
 """
-import statistics
 import sys
-import matplotlib.pyplot as plt
-from market import Market
-from buckets import bucketwidth, bucketize, distribution, value_offset
+from functools import partial
+import numpy as np
+from market import Market, sampling, describe
+from runner import summarize, converge
+from purchases import fractional_buys
 from compound import compound_rate
+from quantiles import tails
+from plots import pyplot, finish
 
 
 def strat_bottom(sequence, fractions, monthly=True):
@@ -70,68 +73,132 @@ def strat_bottom(sequence, fractions, monthly=True):
     return in_market + on_side
 
 
+# pylint: disable=too-many-locals
+def strat_bottom_batch(growth, dividend, interest, fractions, monthly=True):
+    """
+    Only buy at the lowest prices, for a batch of sequences
+    :param growth: (runs, length) array of appreciation
+    :param dividend: (runs, length) array of dividends
+    :param interest: (runs, length) array of interest rates
+    :param fractions: list of max numbers of lots
+           (we are willing to buy in at earlier lows)
+    :param monthly(bool): monthly (vs annual) sequences
+    :return (array): (runs, len(fractions)) values at end of simulation
+    """
+    (runs, length) = growth.shape
+    steps = np.arange(length)
+
+    # one prefix-minimum pass: lows[:, i] is the first lowest point in [0, i]
+    market = np.cumprod(1.0 + growth, axis=1)
+    new_low = np.ones(market.shape, dtype=bool)
+    new_low[:, 1:] = (market[:, 1:] <
+                      np.minimum.accumulate(market, axis=1)[:, :-1])
+    lows = np.maximum.accumulate(np.where(new_low, steps, 0), axis=1)
+
+    # the absolute bottom, and then the next lowest earlier prices
+    rows = np.arange(runs)
+    buypoints = np.full((runs, max(fractions)), -1)
+    buypoints[:, 0] = lows[:, -1]
+    for fract in range(1, max(fractions)):
+        # see who has not yet run out of opportunities
+        earlier = buypoints[:, fract-1]
+        more = earlier > 0
+        buypoints[more, fract] = lows[rows[more], earlier[more] - 1]
+
+    # each buy point moves an equal fraction of the side into the market
+    purchases = np.zeros((runs, len(fractions), length))
+    for col, lots in enumerate(fractions):
+        chosen = buypoints[:, :lots]
+        used = chosen >= 0
+        (run, lot) = np.nonzero(used)
+        purchases[run, col, chosen[run, lot]] = 1.0 / used.sum(axis=1)[run]
+
+    # if we are monthly, scale the interest and dividends
+    scale = 12 if monthly else 1
+    return fractional_buys(purchases,
+                           (1.0 + growth + dividend / scale)[:, None],
+                           (1.0 + interest / scale)[:, None])
+
+
 # general simulation parameters
 NUM_RUNS = 200      # number of runs per model
 NUM_YEARS = 20      # number of years to track results
+BLOCK_YEARS = 5     # mean length of a bootstrap block
+TARGET_SEM = 0.05   # standard error of the mean, for adaptive runs
 MY_NAME = "Bottom-Buying"
 OUTPUT = "Bottom.png"
 
 
 # pylint: disable=too-many-locals
-def main(random):
+def main(random, workers=None, seed=None, target=None, plot=True):
     """
     Only buy in at lows
         run <num_runs> simulations
         tracking output over 20 years
         plot a return distribution
+    :param random(bool): random months (vs real sequences), or other mode
+    :param workers(int): number of worker processes (default: one per cpu)
+    :param seed(int): seed for the random choices (for reproducible runs)
+    :param target(float): run until the mean's standard error is this small
+    :param plot(bool): plot the distributions (vs just the text report)
     """
 
     # parameters specific to this continuous purchase model
-    title = ("Random" if random else "Real sequence") + " simulations of "
+    title = describe(random) + " simulations of "
     monthly = True     # monthly simulations
     formats = ["w.", "r.", "y+", "g*", "co"]
 
     legends = []
+    curves = []
     simulator = Market(monthly=monthly)
-    for fractions in [1, 2, 3, 4]:
-        results = []
-        # a statistically interesting number of runs
-        for _runs in range(NUM_RUNS * 2 if random else NUM_RUNS):
-            sequence = simulator.rates(length=NUM_YEARS*12, random=random)
-            results.append(strat_bottom(sequence, fractions, monthly))
 
+    # every number of lots is evaluated against the same sequences
+    choices = [1, 2, 3, 4]
+    kernel = partial(strat_bottom_batch, monthly=monthly)
+    if target is None:
+        summaries = summarize(simulator, kernel, choices,
+                              NUM_RUNS * 2 if random else NUM_RUNS,
+                              NUM_YEARS*12, random=random, workers=workers,
+                              seed=seed)
+    else:
+        summaries = converge(simulator, kernel, choices, NUM_YEARS*12, target,
+                             random=random, workers=workers, seed=seed)
+
+    for (fractions, summary) in zip(choices, summaries):
         # summarize the results
-        mean = sum(results) / len(results)
-        sigma = statistics.stdev(results)
+        mean = summary.moments.mean
+        sigma = summary.moments.stdev()
         report = "{} over {} years in {} pieces: mean={:.2f}, sigma={:.2f}" + \
                  ", {:.2f}%/y"
         print(report.format(MY_NAME, NUM_YEARS, fractions, mean, sigma,
               100*compound_rate(mean, NUM_YEARS)))
+        print(tails(summary.digest))
+        if target is not None:
+            print(f"\t({summary.moments.count} runs)")
 
-        # bucketize and display the results
-        granularity = bucketwidth(results)
-        buckets = bucketize(results, granularity)
-        offset = value_offset(results)
-        (x_values, y_values) = distribution(buckets, granularity, offset)
-
-        plt.plot(x_values, y_values, formats[fractions])
+        # display the distribution of results
+        (x_values, y_values) = summary.histogram.distribution()
+        curves.append((x_values, y_values, formats[fractions]))
         legends.append("fractions=" + str(fractions))
 
+    if not plot:
+        return
+
     # put up the title, axes, and data
+    plt = pyplot(OUTPUT)
+    for (x_values, y_values, fmt) in curves:
+        plt.plot(x_values, y_values, fmt)
     plt.title(title + MY_NAME)
     plt.xlabel(str(NUM_YEARS) + "-year return")
     plt.ylabel("probability")
     plt.legend(legends)
-    if OUTPUT is None:
-        plt.show()
-    else:
-        print("saving distribution plot as " + OUTPUT)
-        plt.savefig(OUTPUT)
-        plt.close()
+    finish(plt, OUTPUT)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1 and sys.argv[1] == "random":
-        main(True)
-    else:
-        main(False)
+    # usage: [random|blocks|all] [latin|quasi] [adaptive] [--no-plot] [seed]
+    ARGS = sys.argv[1:]
+    SEEDS = [int(arg) for arg in ARGS if arg.isdigit()]
+    main(sampling(ARGS, BLOCK_YEARS * 12), seed=SEEDS[0] if SEEDS else None,
+         target=TARGET_SEM if "adaptive" in ARGS else None,
+         plot="--no-plot" not in ARGS)
@@ -1,12 +1,15 @@
 """
 Purchasing Strategy: continuous
 """
-import statistics
 import sys
-import matplotlib.pyplot as plt
-from market import Market
-from buckets import bucketwidth, bucketize, distribution, value_offset
+from functools import partial
+import numpy as np
+from market import Market, sampling, describe
+from runner import summarize, converge
+from purchases import scheduled_buys
 from compound import compound_rate
+from quantiles import tails
+from plots import pyplot, finish
 
 
 def strat_continuous(sequence, period, monthly=False):
@@ -40,70 +43,122 @@ def strat_continuous(sequence, period, monthly=False):
     return in_market + on_side
 
 
+def schedule_of(plan, length):
+    """
+    Turn a purchase plan into a schedule of purchases
+    :param plan: number of periods to buy in over (uniformly), or a
+                 schedule of the amounts to buy after each period
+    :param length: number of periods in each sequence
+    :return (array): (length) amounts to buy after each period
+    """
+    if np.ndim(plan) == 0:
+        return np.full(length, 1.0 / plan)
+    return np.asarray(plan, dtype=np.float64)
+
+
+def strat_continuous_batch(growth, dividend, interest, plans,
+                           monthly=False):
+    """
+    Buy a position over N years (or months), for a batch of sequences
+    and a list of purchase periods (and/or arbitrary purchase schedules)
+    :param growth: (runs, length) array of appreciation
+    :param dividend: (runs, length) array of dividends
+    :param interest: (runs, length) array of interest rates
+    :param plans: list of numbers of periods for (uniform) buy-in, or of
+                  (length) schedules of amounts to buy after each period
+    :param monthly(bool): monthly (vs annual) sequences
+    :return (array): (runs, plans) values at end
+    """
+    schedules = np.stack([schedule_of(plan, growth.shape[1])
+                          for plan in plans])
+
+    # if we are monthly, scale the interest and dividends
+    scale = 12 if monthly else 1
+    return scheduled_buys(schedules,
+                          1.0 + growth + dividend / scale,
+                          1.0 + interest / scale)
+
+
 # general simulation parameters
 NUM_RUNS = 50       # number of runs per model
 NUM_YEARS = 20      # number of years to track results
+BLOCK_YEARS = 5     # mean length of a bootstrap block
+TARGET_SEM = 0.05   # standard error of the mean, for adaptive runs
 MY_NAME = "Continuous Purchases"
 OUTPUT = "Continuous.png"
 
 
 # pylint: disable=too-many-locals
-def main(random):
+def main(random, workers=None, seed=None, target=None, plot=True):
     """
     For purchases over 1-5 years,
         run <num_runs> simulations
         tracking output over 20 years
         plot a return distribution
+    :param random(bool): random months (vs real sequences), or other mode
+    :param workers(int): number of worker processes (default: one per cpu)
+    :param seed(int): seed for the random choices (for reproducible runs)
+    :param target(float): run until the mean's standard error is this small
+    :param plot(bool): plot the distributions (vs just the text report)
     """
 
     # parameters specific to this continuous purchase model
-    title = ("Random" if random else "Real sequence") + " simulations of "
+    title = describe(random) + " simulations of "
     monthly = False     # annual simulations
     max_period = 5
     formats = ["w.", "r.", "y*", "go", "c+", "bx"]
 
     legends = []
+    curves = []
     simulator = Market(monthly=monthly)
-    # purchases spread out over 1-5 years
-    for years in range(1, max_period + 1):
-        results = []
-        # a statistically interesting number of runs
-        for _runs in range(NUM_RUNS * 2 if random else NUM_RUNS):
-            sequence = simulator.rates(length=NUM_YEARS, random=random)
-            results.append(strat_continuous(sequence, NUM_YEARS, monthly))
 
+    # purchases spread out over 1-5 years (against the same sequences)
+    periods = list(range(1, max_period + 1))
+    kernel = partial(strat_continuous_batch, monthly=monthly)
+    if target is None:
+        summaries = summarize(simulator, kernel, periods,
+                              NUM_RUNS * 2 if random else NUM_RUNS,
+                              NUM_YEARS, random=random, workers=workers,
+                              seed=seed)
+    else:
+        summaries = converge(simulator, kernel, periods, NUM_YEARS, target,
+                             random=random, workers=workers, seed=seed)
+
+    for (years, summary) in zip(periods, summaries):
         # summarize the results
-        mean = sum(results) / len(results)
-        sigma = statistics.stdev(results)
+        mean = summary.moments.mean
+        sigma = summary.moments.stdev()
         report = "{} over {} years, {} years: mean={:.2f}, sigma={:.2f}" + \
                  ", {:.2f}%/y"
         print(report.format(MY_NAME, years, NUM_YEARS, mean, sigma,
               100*compound_rate(mean, NUM_YEARS)))
+        print(tails(summary.digest))
+        if target is not None:
+            print(f"\t({summary.moments.count} runs)")
 
-        # bucketize and display the results
-        granularity = bucketwidth(results)
-        buckets = bucketize(results, granularity)
-        offset = value_offset(results)
-        (x_values, y_values) = distribution(buckets, granularity, offset)
-
-        plt.plot(x_values, y_values, formats[years])
+        # display the distribution of results
+        (x_values, y_values) = summary.histogram.distribution()
+        curves.append((x_values, y_values, formats[years]))
         legends.append("over " + str(years) + " years")
 
+    if not plot:
+        return
+
     # put up the title, axes, and data
+    plt = pyplot(OUTPUT)
+    for (x_values, y_values, fmt) in curves:
+        plt.plot(x_values, y_values, fmt)
     plt.title(title + MY_NAME)
     plt.xlabel(str(NUM_YEARS) + "-year return")
     plt.ylabel("probability")
     plt.legend(legends)
-    if OUTPUT is None:
-        plt.show()
-    else:
-        print("saving distribution plot as " + OUTPUT)
-        plt.savefig(OUTPUT)
-        plt.close()
+    finish(plt, OUTPUT)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1 and sys.argv[1] == "random":
-        main(True)
-    else:
-        main(False)
+    # usage: [random|blocks|all] [latin|quasi] [adaptive] [--no-plot] [seed]
+    ARGS = sys.argv[1:]
+    SEEDS = [int(arg) for arg in ARGS if arg.isdigit()]
+    main(sampling(ARGS, BLOCK_YEARS), seed=SEEDS[0] if SEEDS else None,
+         target=TARGET_SEM if "adaptive" in ARGS else None,
+         plot="--no-plot" not in ARGS)
@@ -1,12 +1,31 @@
 """
 Purchasing Strategy: Buy on the dips
 """
-import statistics
 import sys
-import matplotlib.pyplot as plt
-from market import Market
-from buckets import bucketwidth, bucketize, distribution, value_offset
+from functools import partial
+import numpy as np
+from market import Market, sampling, describe
+from runner import summarize, converge
+from purchases import fractional_buys
 from compound import compound_rate
+from quantiles import tails
+from plots import pyplot, finish
+
+
+def buy_schedule(max_dip, buy_points):
+    """
+    figure out how much to buy at what thresholds (from max to min)
+    :param max_dip(float): drop percent to trigger full buy-in
+    :param buy_points(int): how many (max/4) buy points do we have
+    :return ([float], [float]): drop thresholds, fraction to purchase
+    """
+    thresholds = [max_dip] * buy_points
+    purchases = [1.0] * buy_points
+    for i in range(1, buy_points):
+        thresholds[i] = (buy_points-i) * max_dip / buy_points
+        purchases[i] = purchases[i-1]/2
+
+    return (thresholds, purchases)
 
 
 def strat_dips(sequence, max_dip, buy_points, monthly=True):
@@ -20,11 +39,7 @@ def strat_dips(sequence, max_dip, buy_points, monthly=True):
     """
 
     # figure out how much to buy at what thresholds (from max to min)
-    thresholds = [max_dip] * buy_points
-    purchases = [1.0] * buy_points
-    for i in range(1, buy_points):
-        thresholds[i] = (buy_points-i) * max_dip / buy_points
-        purchases[i] = purchases[i-1]/2
+    (thresholds, purchases) = buy_schedule(max_dip, buy_points)
 
     # play the sequence, buying on the dips
     in_market = 0.0     # start out with nothing in market
@@ -58,24 +73,66 @@ def strat_dips(sequence, max_dip, buy_points, monthly=True):
     return in_market + on_side
 
 
+# pylint: disable=too-many-locals
+def strat_dips_batch(growth, dividend, interest, grid, monthly=True):
+    """
+    Only buy at the lowest prices, for a batch of sequences and a
+    grid of buying parameters
+    :param growth: (runs, length) array of appreciation
+    :param dividend: (runs, length) array of dividends
+    :param interest: (runs, length) array of interest rates
+    :param grid: list of (max_dip, buy_points) combinations
+    :param monthly(bool): monthly (vs annual) sequences
+    :return (array): (runs, combinations) values at end of simulation
+    """
+    # how far below its running maximum is the market after each period
+    market = np.cumprod(1.0 + growth, axis=1)
+    market_max = np.maximum(np.maximum.accumulate(market, axis=1), 1.0)
+    drops = (market_max - market) / market_max
+
+    # if we are monthly, scale the interest and dividends
+    scale = 12 if monthly else 1
+    in_growth = 1.0 + growth + dividend / scale
+    side_growth = 1.0 + interest / scale
+
+    # one combination at a time, so only one (runs, length) set of
+    # purchase fractions (and accounting) is live at once
+    values = np.empty((growth.shape[0], len(grid)))
+    for col, (max_dip, buy_points) in enumerate(grid):
+        (thresholds, purchases) = buy_schedule(max_dip, buy_points)
+
+        # the deepest threshold each drop exceeds (0 means none)
+        exceeded = np.searchsorted(thresholds[::-1], drops)
+        fractions = np.array([0.0] + purchases[::-1])[exceeded]
+        values[:, col] = fractional_buys(fractions, in_growth, side_growth)
+    return values
+
+
 # general simulation parameters
 NUM_RUNS = 200      # number of runs per model
 NUM_YEARS = 20      # number of years to track results
+BLOCK_YEARS = 5     # mean length of a bootstrap block
+TARGET_SEM = 0.05   # standard error of the mean, for adaptive runs
 MY_NAME = "Buy the Dips"
 OUTPUT = "Dips.png"
 
 
 # pylint: disable=too-many-locals
-def main(random):
+def main(random, workers=None, seed=None, target=None, plot=True):
     """
     Buy on the dips
         run <NUM_RUNS> simulations
         tracking output over 20 years
         plot a return distribution
+    :param random(bool): random months (vs real sequences), or other mode
+    :param workers(int): number of worker processes (default: one per cpu)
+    :param seed(int): seed for the random choices (for reproducible runs)
+    :param target(float): run until the mean's standard error is this small
+    :param plot(bool): plot the distributions (vs just the text report)
     """
 
     # parameters specific to this continuous purchase model
-    title = ("Random" if random else "Real sequence") + " simulations of "
+    title = describe(random) + " simulations of "
     monthly = True     # monthly simulations
 
     # mappings from parameters into point formats
@@ -83,53 +140,63 @@ def main(random):
     symbols = ["x", ".", "o", "+", "*"]
 
     legends = []
+    curves = []
     simulator = Market(monthly=monthly)
-    # for a range of plausible dip thresholds
-    for max_dip in (0.10, 0.15, 0.20, 0.25):
-        # are we willing to buy part on smaller dips
-        for buy_points in [1, 2, 3]:
-            results = []
-            # a statistically interesting number of runs
-            for _runs in range(NUM_RUNS * 2 if random else NUM_RUNS):
-                sequence = simulator.rates(length=NUM_YEARS*12, random=random)
-                results.append(strat_dips(sequence, max_dip, buy_points,
-                               monthly))
-
-            # summarize the results
-            mean = sum(results) / len(results)
-            sigma = statistics.stdev(results)
-            report = "{}({}%/{}) over {} years: mean={:.2f}, sigma={:.2f}" + \
-                 ", {:.2f}%/y"
-            print(report.format(MY_NAME,
-                  int(100*max_dip), buy_points, NUM_RUNS, mean, sigma,
-                  100*compound_rate(mean, NUM_YEARS)))
-
-            # bucketize and display the results
-            granularity = bucketwidth(results)
-            buckets = bucketize(results, granularity)
-            offset = value_offset(results)
-            (x_values, y_values) = distribution(buckets, granularity, offset)
-
-            plt.plot(x_values, y_values, colors[max_dip] + symbols[buy_points])
-            legends.append(str(int(max_dip*100)) + "% dip/" + str(buy_points))
-
-        print("")   # blank line between changes in threshold
+
+    # every combination is evaluated against the same sequences
+    dips = (0.10, 0.15, 0.20, 0.25)    # a range of plausible dip thresholds
+    points = [1, 2, 3]      # are we willing to buy part on smaller dips
+    grid = [(max_dip, buy_points) for max_dip in dips for buy_points in points]
+    kernel = partial(strat_dips_batch, monthly=monthly)
+    if target is None:
+        summaries = summarize(simulator, kernel, grid,
+                              NUM_RUNS * 2 if random else NUM_RUNS,
+                              NUM_YEARS*12, random=random, workers=workers,
+                              seed=seed)
+    else:
+        summaries = converge(simulator, kernel, grid, NUM_YEARS*12, target,
+                             random=random, workers=workers, seed=seed)
+
+    for ((max_dip, buy_points), summary) in zip(grid, summaries):
+        # summarize the results
+        mean = summary.moments.mean
+        sigma = summary.moments.stdev()
+        report = "{}({}%/{}) over {} years: mean={:.2f}, sigma={:.2f}" + \
+            ", {:.2f}%/y"
+        print(report.format(MY_NAME,
+              int(100*max_dip), buy_points, NUM_RUNS, mean, sigma,
+              100*compound_rate(mean, NUM_YEARS)))
+        print(tails(summary.digest))
+        if target is not None:
+            print(f"\t({summary.moments.count} runs)")
+
+        # display the distribution of results
+        (x_values, y_values) = summary.histogram.distribution()
+        curves.append((x_values, y_values,
+                       colors[max_dip] + symbols[buy_points]))
+        legends.append(str(int(max_dip*100)) + "% dip/" + str(buy_points))
+
+        if buy_points == points[-1]:
+            print("")   # blank line between changes in threshold
+
+    if not plot:
+        return
 
     # put up the title, axes, and data
+    plt = pyplot(OUTPUT)
+    for (x_values, y_values, fmt) in curves:
+        plt.plot(x_values, y_values, fmt)
     plt.title(title + MY_NAME)
     plt.xlabel(str(NUM_YEARS) + "-year return")
     plt.ylabel("probability")
     plt.legend(legends)
-    if OUTPUT is None:
-        plt.show()
-    else:
-        print("saving distribution plot as " + OUTPUT)
-        plt.savefig(OUTPUT)
-        plt.close()
+    finish(plt, OUTPUT)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1 and sys.argv[1] == "random":
-        main(True)
-    else:
-        main(False)
+    # usage: [random|blocks|all] [latin|quasi] [adaptive] [--no-plot] [seed]
+    ARGS = sys.argv[1:]
+    SEEDS = [int(arg) for arg in ARGS if arg.isdigit()]
+    main(sampling(ARGS, BLOCK_YEARS * 12), seed=SEEDS[0] if SEEDS else None,
+         target=TARGET_SEM if "adaptive" in ARGS else None,
+         plot="--no-plot" not in ARGS)